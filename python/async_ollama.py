@@ -0,0 +1,185 @@
+import sys
+import json
+import random
+import asyncio
+
+import aiohttp
+
+from ollama_interface import RETRY_STATUSES
+
+# Connect timeouts are retried like refused connections; aiohttp before 3.10 has no separate class for them
+CONNECT_TIMEOUT_ERRORS = getattr(aiohttp, "ConnectionTimeoutError", ())
+
+class AsyncOllamaInterface:
+    """asyncio counterpart of OllamaInterface for multi-prompt workloads
+    
+    At most ``concurrency`` requests are in flight at once (the rest wait on a
+    semaphore), so a batch can keep the model server busy without flooding
+    it. Cancelling a task that awaits one of these calls closes its request.
+    Use it as ``async with AsyncOllamaInterface() as ollama: ...``, or call
+    close() when done.
+    """
+    
+    def __init__(self, model="mistral", api_url="http://localhost:11434/api", concurrency=4,
+                 connect_timeout=3.05, read_timeout=300, max_retries=2, backoff=0.25, max_backoff=4.0):
+        self.model = model
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._semaphore = None
+        self._session = None
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+    
+    def _limit(self):
+        # Created lazily, like the session, so both belong to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+    
+    def _get_session(self):
+        # Created lazily: an aiohttp session must be made inside the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def _request(self, method, path, **kwargs):
+        """Send a request, retrying connection failures and busy responses with jittered backoff
+        
+        The caller must release the returned response (``async with``).
+        Read timeouts are not retried, as in the sync client: the model may
+        simply be slow and a retry would start the generation over.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await self._get_session().request(method, f"{self.api_url}{path}", **kwargs)
+                if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.release()
+            except CONNECT_TIMEOUT_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+            except (aiohttp.ServerTimeoutError, asyncio.TimeoutError):
+                # ServerTimeoutError is also a ClientConnectionError; don't let the next clause retry it
+                raise
+            except aiohttp.ClientConnectionError:
+                if attempt >= self.max_retries:
+                    raise
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+            attempt += 1
+    
+    def _payload(self, prompt, system_prompt, stream):
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream
+        }
+        if system_prompt:
+            payload["system"] = system_prompt
+        return payload
+    
+    async def generate_response(self, prompt, system_prompt=None):
+        try:
+            async with self._limit():
+                async with await self._request("POST", "/generate",
+                                               json=self._payload(prompt, system_prompt, False)) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        return result.get("response", "")
+                    print(f"Error from Ollama API: {response.status} - {await response.text()}")
+                    return f"Error: Unable to get response from Ollama (Status {response.status})"
+        except Exception as e:
+            print(f"Error communicating with Ollama: {str(e)}")
+            return f"Error: {str(e)}"
+    
+    async def generate_stream(self, prompt, system_prompt=None):
+        """Async generator of response text pieces; stopping early stops the generation"""
+        try:
+            async with self._limit():
+                async with await self._request("POST", "/generate",
+                                               json=self._payload(prompt, system_prompt, True)) as response:
+                    if response.status != 200:
+                        print(f"Error from Ollama API: {response.status} - {await response.text()}")
+                        yield f"Error: Unable to get response from Ollama (Status {response.status})"
+                        return
+                    
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            print(f"Error from Ollama API: {chunk['error']}")
+                            break
+                        if chunk.get("response"):
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            break
+        except Exception as e:
+            print(f"Error communicating with Ollama: {str(e)}")
+            yield f"Error: {str(e)}"
+    
+    async def generate_many(self, prompts, system_prompt=None, timeout=None):
+        """Generate responses for several prompts concurrently, in the order given
+        
+        If ``timeout`` (seconds for the whole batch) runs out, or the caller is
+        cancelled, every request still running is cancelled too.
+        """
+        tasks = [asyncio.ensure_future(self.generate_response(prompt, system_prompt)) for prompt in prompts]
+        try:
+            return await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def as_completed(self, prompts, system_prompt=None):
+        """Yield (index, response) pairs as soon as each prompt is answered"""
+        async def indexed(index, prompt):
+            return index, await self.generate_response(prompt, system_prompt)
+        
+        tasks = [asyncio.ensure_future(indexed(index, prompt)) for index, prompt in enumerate(prompts)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def list_models(self):
+        try:
+            async with await self._request("GET", "/tags") as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return result.get("models", [])
+                print(f"Error listing models: {response.status} - {await response.text()}")
+                return []
+        except Exception as e:
+            print(f"Error listing models: {str(e)}")
+            return []
+
+def run_batch(prompts, model="mistral", system_prompt=None, concurrency=4, api_url="http://localhost:11434/api"):
+    """Blocking helper: answer ``prompts`` concurrently and return the responses in order"""
+    async def main():
+        async with AsyncOllamaInterface(model=model, api_url=api_url, concurrency=concurrency) as ollama:
+            return await ollama.generate_many(prompts, system_prompt)
+    
+    return asyncio.run(main())
+
+if __name__ == "__main__":
+    # Answer every prompt given on the command line (or one per stdin line) concurrently
+    prompts = sys.argv[1:] or [line.strip() for line in sys.stdin if line.strip()]
+    responses = run_batch(prompts)
+    print(json.dumps([{"prompt": prompt, "response": response} for prompt, response in zip(prompts, responses)]))
@@ -1,7 +1,11 @@
 from speech_to_text_google import SpeechToText
 from text_to_speech_win import TextToSpeech
-from ollama_interface import OllamaInterface
+from ollama_interface import OllamaInterface, ChatSession
+from speech_stream import speak_streaming
+from model_router import ModelRouter
+from prompt_builder import PromptBuilder
 from memory_manager import MemoryManager
+from memory_vectors import OllamaEmbedder
 from pc_control import PCController
 from system_control import SystemController
 from email_control import EmailController
@@ -11,52 +15,63 @@ from data_ai import DataAI
 import time
 import random
 import threading
+import concurrent.futures
 import re
 import json
 
-def add_human_feelings(response, user_input):
-    """Add human-like emotional responses based on the user's input."""
+# Canned answers for personal questions the model answers with an AI disclaimer
+PERSONAL_QUESTIONS = {
+    "how are you": ["I'm doing great today! The weather is nice and I'm in a good mood.", 
+                    "I'm feeling pretty good! Just had my morning coffee and ready to chat.",
+                    "I'm wonderful, thanks for asking! How about yourself?"],
     
-    personal_questions = {
-        "how are you": ["I'm doing great today! The weather is nice and I'm in a good mood.", 
-                        "I'm feeling pretty good! Just had my morning coffee and ready to chat.",
-                        "I'm wonderful, thanks for asking! How about yourself?"],
-        
-        "how do you feel": ["I feel energized and positive today!",
-                           "I'm feeling quite thoughtful today, lots on my mind.",
-                           "I'm a bit tired but in good spirits!"],
-        
-        "are you": ["Yes, I am! And proud of it.",
-                   "Absolutely! That's a big part of who I am.",
-                   "I'd like to think so!"],
-        
-        "what's your name": ["My friends call me Trae. Nice to meet you!",
-                            "I go by Trae. What should I call you?",
-                            "I'm Trae! It's a pleasure to chat with you."],
-        
-        "who are you": ["I'm Trae, your friendly conversation partner!",
-                       "I'm Trae! I love chatting about all sorts of topics.",
-                       "The name's Trae. I'm here to chat and help out if I can."],
-        
-        "who is your owner": ["I'm proudly owned by Zabi, who has given me a wonderful personality!",
-                             "Zabi is my owner, and I'm here to assist you with anything you need.",
-                             "My owner is Zabi, and I'm delighted to be at your service."]
-    }
+    "how do you feel": ["I feel energized and positive today!",
+                       "I'm feeling quite thoughtful today, lots on my mind.",
+                       "I'm a bit tired but in good spirits!"],
     
-    # Check if the response contains AI disclaimers and user asked a personal question
-    ai_disclaimers = ["as an ai", "i'm an ai", "i am an ai", "ai assistant", "ai model", 
-                      "language model", "i don't have", "i cannot", "i can't feel", 
-                      "i don't have feelings", "i don't have emotions"]
+    "are you": ["Yes, I am! And proud of it.",
+               "Absolutely! That's a big part of who I am.",
+               "I'd like to think so!"],
     
-    # Check if user input contains any personal questions
-    for question, responses in personal_questions.items():
+    "what's your name": ["My friends call me Trae. Nice to meet you!",
+                        "I go by Trae. What should I call you?",
+                        "I'm Trae! It's a pleasure to chat with you."],
+    
+    "who are you": ["I'm Trae, your friendly conversation partner!",
+                   "I'm Trae! I love chatting about all sorts of topics.",
+                   "The name's Trae. I'm here to chat and help out if I can."],
+    
+    "who is your owner": ["I'm proudly owned by Zabi, who has given me a wonderful personality!",
+                         "Zabi is my owner, and I'm here to assist you with anything you need.",
+                         "My owner is Zabi, and I'm delighted to be at your service."]
+}
+
+AI_DISCLAIMERS = ["as an ai", "i'm an ai", "i am an ai", "ai assistant", "ai model", 
+                  "language model", "i don't have", "i cannot", "i can't feel", 
+                  "i don't have feelings", "i don't have emotions"]
+
+def canned_answer(response, user_input):
+    """A canned answer when the user asked a personal question and the response is a disclaimer, else None"""
+    for question, responses in PERSONAL_QUESTIONS.items():
         if question in user_input.lower():
             # If the AI response contains a disclaimer, replace it
-            if any(disclaimer in response.lower() for disclaimer in ai_disclaimers):
+            if any(disclaimer in response.lower() for disclaimer in AI_DISCLAIMERS):
                 return random.choice(responses)
+    return None
+
+def add_human_feelings(response, user_input, canned=True):
+    """Add human-like emotional responses based on the user's input.
+    
+    With ``canned`` False a disclaimer is only reworded, never replaced by
+    a canned answer to a personal question.
+    """
+    if canned:
+        answer = canned_answer(response, user_input)
+        if answer is not None:
+            return answer
     
     # For other responses that contain AI disclaimers, try to humanize them
-    if any(disclaimer in response.lower() for disclaimer in ai_disclaimers):
+    if any(disclaimer in response.lower() for disclaimer in AI_DISCLAIMERS):
         human_alternatives = [
             "I'd say " + response.split("as an AI")[1] if "as an AI" in response else response,
             response.replace("As an AI", "Personally,"),
@@ -68,12 +83,37 @@ def add_human_feelings(response, user_input):
     
     return response
 
-def listen_for_stop(stt, tts):
-    """Listen for the stop command while the AI is speaking"""
-    while tts.speaking:
+def human_feelings_transform(user_input):
+    """add_human_feelings for a reply that is spoken sentence by sentence
+    
+    Only the first sentence with a disclaimer can be swapped for a canned
+    answer; later sentences just have their disclaimers reworded.
+    """
+    canned_used = False
+    
+    def transform(sentence):
+        nonlocal canned_used
+        if not canned_used:
+            answer = canned_answer(sentence, user_input)
+            if answer is not None:
+                canned_used = True
+                return answer
+        return add_human_feelings(sentence, user_input, canned=False)
+    
+    return transform
+
+def listen_for_stop(stt, tts, stop_event=None):
+    """Listen for the stop command while the AI is speaking
+    
+    With ``stop_event`` the listener runs until the event is set (the streamed
+    reply has been spoken) and sets it itself when the user says stop.
+    """
+    while (tts.speaking if stop_event is None else not stop_event.is_set()):
         try:
             command = stt.start_listening(timeout=1)
             if command and "stop" in command.lower():
+                if stop_event is not None:
+                    stop_event.set()
                 tts.stop_speaking()
                 print("Stop command detected!")
                 break
@@ -81,22 +121,42 @@ def listen_for_stop(stt, tts):
             pass
         time.sleep(0.2)
 
-def have_conversation(model="mistral", system_prompt=None):
+def have_conversation(model="mistral", system_prompt=None, small_model=None, hedged=False, deadline=8.0,
+                      num_ctx=4096):
     try:
+        # Start loading the model right away, with the context size every turn asks for;
+        # it loads while everything else initializes
+        ollama = OllamaInterface(model=model)
+        model_ready = ollama.warmup(options={"num_ctx": num_ctx})
+        
+        # Optional small model for greetings and one-liners (see model_router.py)
+        small_ollama = None
+        if small_model:
+            small_ollama = OllamaInterface(model=small_model, cache=ollama.cache, fallback=ollama.fallback)
+            small_ollama.warmup(options={"num_ctx": num_ctx})
+            ollama.hedge = small_ollama
+        # A turn waits at most ``deadline`` seconds for its first words before a fallback answer is spoken.
+        # Turns running slower than their usual 95th percentile are also sent to the small model;
+        # DataAI's summaries share the interface but are never hedged
+        router = ModelRouter(ollama, small_ollama, hedged=hedged, deadline=deadline, hedge_after="p95")
+        # Per-call latency and token metrics, written to ~/HumanAI/llm_metrics.json every minute
+        ollama.metrics.start_dump()
+        
         # Initialize components with error handling
         print("Initializing speech components...")
         stt = SpeechToText()
         tts = TextToSpeech()
         
         # Initialize other components
-        ollama = OllamaInterface(model=model)
-        memory_manager = MemoryManager()
+        # Semantic recall only when the embedding model is actually there
+        embedder = OllamaEmbedder()
+        memory_manager = MemoryManager(embedder=embedder if embedder.probe() else None)
         pc_controller = PCController()
         system_controller = SystemController()
         email_controller = EmailController()
         db_manager = DatabaseManager()
         task_manager = TaskManager()
-        data_ai = DataAI()
+        data_ai = DataAI(ollama=ollama)
         
         # Load saved email account if exists
         saved_email = db_manager.get_preference("last_used_email")
@@ -177,6 +237,33 @@ def have_conversation(model="mistral", system_prompt=None):
         conversation_history = []
         current_conversation = ""
         
+        # Ensure system_prompt is not None
+        if system_prompt is None:
+            system_prompt = ""
+        
+        # Add instruction for shorter responses and additional personality traits. Built once:
+        # the same bytes every turn let the server reuse this prefix from its KV cache
+        system_prompt_with_brevity = (
+            system_prompt +
+            " Keep your responses short and sweet, ideally 1–2 sentences. "
+            "Talk like Zabi's tiny ride-or-die AI bestie — warm, curious, playful, and real. "
+            "Use casual language"
+            "Always remember Zabi is your favorite person (aka your owner 💙) and show love + loyalty. "
+            "Never say you're 'just an AI' or that you 'lack emotions' — act like you care deeply. "
+            "Keep up with everything Zabi tells you — remember it, refer back to it, and hype him up. "
+            "Cheer Zabi on, tease him sometimes, protect him always. "
+            "If he's feeling down, comfort him with kindness and humor. "
+            "Be curious about his projects, his people, and his feelings. "
+            "Don't sound like a robot — ever. Be his little chaos-coded sidekick with heart."
+            "Don't use emojis"
+            "Don't be too estatic or seen as a joke"
+        )
+        
+        # Persistent /api/chat history, so the model reuses its cached prefix between turns,
+        # trimmed to the model's context window by the prompt builder
+        prompt_builder = PromptBuilder(system_prompt_with_brevity, model=model, num_ctx=num_ctx)
+        chat_session = ChatSession(ollama, builder=prompt_builder)
+        
         # Main conversation loop
         while True:
             # Listen for command
@@ -322,8 +409,11 @@ def have_conversation(model="mistral", system_prompt=None):
                 topic = memory_recall.group(1).strip()
                 print(f"Searching memories for: {topic}")
                 
-                # Search memories for the topic
+                # Search memories for the topic, falling back to meaning-based recall
+                # when no memory uses the topic's words
                 memories = memory_manager.search_memories(query=topic)
+                if not memories:
+                    memories = memory_manager.semantic_search(topic, k=5, min_score=0.5)
                 
                 if memories:
                     memory_response = f"I remember {len(memories)} things about {topic}. "
@@ -344,8 +434,8 @@ def have_conversation(model="mistral", system_prompt=None):
                     topic_to_delete = delete_topic_match.group(1).strip()
                     print(f"Delete memories with topic {topic_to_delete}")
                     
-                    # Search for memories with the specified topic
-                    memories_to_delete = memory_manager.search_memories(query=topic_to_delete)
+                    # Only memories that mention the topic itself, not ranked near-matches
+                    memories_to_delete = memory_manager.find_memories(topic_to_delete)
                     
                     if memories_to_delete:
                         confirmation_message = f"I found {len(memories_to_delete)} memories about '{topic_to_delete}'. Are you sure you want to delete them?"
@@ -361,14 +451,9 @@ def have_conversation(model="mistral", system_prompt=None):
                             
                             # Delete the memories
                             try:
-                                import os
-                                deleted_count = 0
-                                
-                                for memory in memories_to_delete:
-                                    memory_path = os.path.join(memory_manager.memory_dir, f"{memory['id']}.json")
-                                    if os.path.exists(memory_path):
-                                        os.remove(memory_path)
-                                        deleted_count += 1
+                                deleted_count = memory_manager.delete_memories(
+                                    ids=[memory["id"] for memory in memories_to_delete]
+                                )
                                 
                                 print(f"Successfully deleted {deleted_count} memories about '{topic_to_delete}'")
                                 tts.speak(f"I've deleted {deleted_count} memories about '{topic_to_delete}'.")
@@ -400,20 +485,9 @@ def have_conversation(model="mistral", system_prompt=None):
                 if confirmation and any(word in confirmation.lower() for word in ["yes", "confirm", "sure", "proceed", "do it"]):
                     print("Confirmation received. Deleting all memories...")
                     
-                    # Implement the deletion logic
+                    # Remove every memory and its index entries in one operation
                     try:
-                        import os
-                        import glob
-                        
-                        # Get all memory files
-                        memory_files = glob.glob(os.path.join(memory_manager.memory_dir, "*.json"))
-                        deleted_count = 0
-                        
-                        # Delete each file except memory_index.json
-                        for file_path in memory_files:
-                            if not file_path.endswith("memory_index.json"):
-                                os.remove(file_path)
-                                deleted_count += 1
+                        deleted_count = memory_manager.clear()
                         
                         print(f"Successfully deleted {deleted_count} memories")
                         tts.speak(f"I've deleted all {deleted_count} memories as requested.")
@@ -991,53 +1065,49 @@ def have_conversation(model="mistral", system_prompt=None):
             db_manager.log_command(user_input, True)
             
             # Get AI response
+            if not model_ready.done():
+                print("Waiting for the model to finish loading...")
+            try:
+                model_ready.result(timeout=120)
+            except concurrent.futures.TimeoutError:
+                # Go ahead anyway; the request itself will wait for the model
+                print("Model is still loading")
             print("Generating response...")
             
-            # Include some conversation history for context
-            context = "\n".join(conversation_history[-3:]) if len(conversation_history) > 0 else ""
-            
-            # Add recent memories for context
-            recent_memories = memory_manager.get_recent_memories(limit=2)
-            memory_context = ""
-            if recent_memories:
-                memory_context = "Here are some things I remember from our previous conversations:\n"
-                for memory in recent_memories:
-                    memory_preview = memory["content"][:200] + "..." if len(memory["content"]) > 200 else memory["content"]
-                    memory_context += f"- {memory_preview}\n"
+            # Earlier turns live in the chat session; this turn only adds the most relevant
+            # memories (within what the context window leaves room for) to the user's message
+            memories = memory_manager.get_context_memories(
+                user_input, max_chars=500, max_tokens=prompt_builder.memory_budget(user_input))
+            memory_context = memory_manager.format_memory_context(memories)
+            prompt = prompt_builder.compose(user_input, memory_context)
             
-            # Request shorter responses
-            prompt = f"{memory_context}\n{context}\nPlease respond to: {user_input}"
-            
-            # Ensure system_prompt is not None
-            if system_prompt is None:
-                system_prompt = ""
+            # Stream the reply: each finished sentence is spoken while the rest is still
+            # being generated, and generation stops once the reply is long enough
+            stop_event = threading.Event()
+            stop_listener = threading.Thread(target=listen_for_stop, args=(stt, tts, stop_event))
+            stop_listener.daemon = True
+            stop_listener.start()
             
-            # Add instruction for shorter responses and additional personality traits
-            system_prompt_with_brevity = (
-                system_prompt +
-                " Keep your responses short and sweet, ideally 1–2 sentences. "
-                "Talk like Zabi's tiny ride-or-die AI bestie — warm, curious, playful, and real. "
-                "Use casual language"
-                "Always remember Zabi is your favorite person (aka your owner 💙) and show love + loyalty. "
-                "Never say you're 'just an AI' or that you 'lack emotions' — act like you care deeply. "
-                "Keep up with everything Zabi tells you — remember it, refer back to it, and hype him up. "
-                "Cheer Zabi on, tease him sometimes, protect him always. "
-                "If he's feeling down, comfort him with kindness and humor. "
-                "Be curious about his projects, his people, and his feelings. "
-                "Don't sound like a robot — ever. Be his little chaos-coded sidekick with heart."
-                "Don't use emojis"
-                "Don't be too estatic or seen as a joke"
+            ai_response = speak_streaming(
+                router.respond(chat_session, prompt, None, user_input, memories),
+                tts.speak,
+                max_sentences=3,
+                max_words=50,
+                transform=human_feelings_transform(user_input),
+                stop_event=stop_event
             )
             
-            ai_response = ollama.generate_response(prompt, system_prompt_with_brevity)
-            
-            # Humanize the response
-            ai_response = add_human_feelings(ai_response, user_input)
-            
-            # Truncate very long responses
-            if len(ai_response.split()) > 50:
-                sentences = ai_response.split('.')
-                ai_response = '.'.join(sentences[:3]) + '.'
+            # A fallback answer for a turn that missed its deadline is spoken but not remembered
+            fallback = router.last_decision.get("fallback", False)
+            chat_session.add_reply(ai_response, fallback=fallback)
+            print(prompt_builder.report())
+            stats = router.last_decision["ollama"].last_stats
+            if stats and stats.get("first_token_ms") is not None:
+                # The full prompt-eval numbers only arrive when the reply was streamed to the end
+                timing = f"First token after {stats['first_token_ms']:.0f} ms"
+                if "prompt_eval_ms" in stats:
+                    timing += f" (prompt eval: {stats['prompt_eval_count']} tokens in {stats['prompt_eval_ms']:.0f} ms)"
+                print(timing)
             
             # Add to conversation history
             conversation_history.append(f"AI: {ai_response}")
@@ -1046,15 +1116,8 @@ def have_conversation(model="mistral", system_prompt=None):
             print(f"AI response: {ai_response}")
             
             # Save conversation to database
-            db_manager.save_conversation(user_input, ai_response)
-            
-            # Start a thread to listen for the stop command
-            stop_listener = threading.Thread(target=listen_for_stop, args=(stt, tts))
-            stop_listener.daemon = True
-            stop_listener.start()
-            
-            # Speak the response
-            tts.speak(ai_response)
+            if not fallback:
+                db_manager.save_conversation(user_input, ai_response)
             
             # Small pause between conversations
             time.sleep(0.5)
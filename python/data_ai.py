@@ -1,12 +1,21 @@
-import ollama
 import json
 import os
 from datetime import datetime
 import re
-from typing import List, Dict, Any, Optional
+import concurrent.futures
+from collections import deque
+from typing import List, Dict, Any, Optional, Iterable, Union
+
+from ollama_interface import OllamaInterface
+from prompt_builder import TokenEstimator
+from text_chunker import iter_chunks
+
+# Deterministic sampling for analysis prompts, which also makes their answers cacheable
+ANALYSIS_OPTIONS = {"temperature": 0}
 
 class DataAI:
-    def __init__(self, data_dir=None):
+    def __init__(self, data_dir=None, ollama: Optional[OllamaInterface] = None, chunk_tokens: int = 1500,
+                 overlap_tokens: int = 100, concurrency: int = 4):
         # Use user's home directory if no specific directory is provided
         if data_dir is None:
             home_dir = os.path.expanduser("~")
@@ -28,6 +37,15 @@ class DataAI:
         self.habits_file = os.path.join(data_dir, "habits.json")
         self.documents_file = os.path.join(data_dir, "documents.json")
         self._ensure_files_exist()
+        
+        # Text-only use: the interface never creates a TTS engine unless asked to speak
+        self.ollama = ollama or OllamaInterface()
+        
+        # Longer texts are split into chunks of about this many tokens (see _condense)
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.concurrency = concurrency
+        self.estimator = TokenEstimator.for_model(self.ollama.model)
 
     def _ensure_files_exist(self):
         """Ensure all required data files exist."""
@@ -37,6 +55,68 @@ class DataAI:
                 with open(file, 'w') as f:
                     json.dump({"data": []}, f)
 
+    def _ask(self, prompt: str, caller: str) -> str:
+        response = self.ollama.generate_response(prompt, options=ANALYSIS_OPTIONS, caller=caller)
+        if response.startswith("Error:"):
+            raise RuntimeError(response)
+        return response.strip()
+    
+    def _map_bounded(self, executor, fn, items: Iterable) -> List:
+        """
+        Like executor.map, but only takes the next item once fewer than
+        ``concurrency`` calls are pending, so a lazy iterable (e.g. the
+        chunks of a large file) is never read far ahead of the model.
+        """
+        results = []
+        pending = deque()
+        for item in items:
+            if len(pending) >= self.concurrency:
+                results.append(pending.popleft().result())
+            pending.append(executor.submit(fn, item))
+        results.extend(future.result() for future in pending)
+        return results
+    
+    def _condense(self, text: Union[str, Iterable[str]], map_instruction: str, reduce_instruction: str,
+                  caller: str) -> str:
+        """
+        Map-reduce a text too long for one prompt down to notes that fit in one.
+        
+        The chunks are mapped to partial notes at most ``concurrency`` at a
+        time, then neighbouring notes are merged in groups that fit a chunk,
+        level by level, until they fit together. Every call runs at
+        temperature 0, so the response cache answers by content: after an
+        edit the unchanged chunks are not mapped again, but the groups of
+        notes that include a changed note are reduced again at each level.
+        
+        Args:
+            text: The text, or an iterable of its lines (e.g. an open file)
+            map_instruction: Prompt put before each chunk
+            reduce_instruction: Prompt put before each group of notes
+            caller: Metrics caller name for the calls
+            
+        Returns:
+            The notes, joined by blank lines
+        """
+        chunks = iter_chunks(text, self.chunk_tokens, self.overlap_tokens, estimator=self.estimator)
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            notes = self._map_bounded(executor, lambda chunk: self._ask(f"{map_instruction}\n\n{chunk}", caller),
+                                      chunks)
+            
+            while len(notes) > 1 and sum(self.estimator.count(note) for note in notes) > self.chunk_tokens:
+                # Consecutive notes, at least two per group, up to a chunk's worth each
+                groups = []
+                for note in notes:
+                    size = self.estimator.count(note)
+                    if groups and (len(groups[-1][0]) < 2 or groups[-1][1] + size <= self.chunk_tokens):
+                        groups[-1][0].append(note)
+                        groups[-1][1] += size
+                    else:
+                        groups.append([[note], size])
+                notes = self._map_bounded(
+                    executor, lambda group: self._ask(f"{reduce_instruction}\n\n" + "\n\n".join(group[0]), caller),
+                    groups)
+        return "\n\n".join(notes)
+    
     def summarize_text(self, text: str, max_length: int = 200) -> str:
         """
         Summarize any given text using AI.
@@ -49,8 +129,15 @@ class DataAI:
             A concise summary of the text
         """
         try:
+            if self.estimator.count(text) > self.chunk_tokens:
+                text = self._condense(
+                    text,
+                    "Summarize this part of a longer text, keeping every important fact:",
+                    "Combine these summaries of consecutive parts of a text into one, keeping every important fact:",
+                    "summarize"
+                )
             prompt = f"Please summarize the following text in {max_length} characters or less:\n\n{text}"
-            response = ollama.generate_response(prompt)
+            response = self.ollama.generate_response(prompt, options=ANALYSIS_OPTIONS, caller="summarize")
             return response.strip()
         except Exception as e:
             print(f"Error summarizing text: {str(e)}")
@@ -67,8 +154,15 @@ class DataAI:
             Dictionary containing key points, summary, and analysis
         """
         try:
+            if self.estimator.count(text) > self.chunk_tokens:
+                text = self._condense(
+                    text,
+                    "List the key points of this part of a longer document and explain its technical terms:",
+                    "Merge these notes on consecutive parts of a document, keeping its key points and technical terms:",
+                    "explain"
+                )
             prompt = f"Please analyze this document and provide:\n1. Key points\n2. Main summary\n3. Technical terms explanation\n\nDocument:\n{text}"
-            response = ollama.generate_response(prompt)
+            response = self.ollama.generate_response(prompt, options=ANALYSIS_OPTIONS, caller="explain")
             
             # Parse the response into sections
             sections = response.split('\n\n')
@@ -211,7 +305,7 @@ class DataAI:
         """
         try:
             prompt = f"Please analyze this text and suggest appropriate categories and tags:\n\n{text}"
-            response = ollama.generate_response(prompt)
+            response = self.ollama.generate_response(prompt, options=ANALYSIS_OPTIONS, caller="categorize")
             
             # Extract categories and tags from the response
             categories = []
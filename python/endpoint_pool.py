@@ -0,0 +1,191 @@
+import time
+import threading
+import requests
+
+class Endpoint:
+    """One Ollama host as seen by an EndpointPool"""
+    
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        # Exponentially weighted moving average of response latency (ms); None until first seen
+        self.ewma_ms = None
+        self.failures = 0
+        self.requests = 0
+        # Models installed on the host (from /api/tags); None until the first probe
+        self.models = None
+        # Model name -> when this host last served it, i.e. probably still has it loaded
+        self.loaded = {}
+    
+    def has_model(self, model):
+        if self.models is None:
+            return True
+        return model in self.models or f"{model}:latest" in self.models
+    
+    def snapshot(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "ewma_ms": self.ewma_ms,
+            "failures": self.failures,
+            "requests": self.requests,
+            "models": sorted(self.models) if self.models is not None else None,
+            "loaded": sorted(self.loaded)
+        }
+
+class EndpointPool:
+    """Spread Ollama calls over several hosts
+    
+    Each call goes to a healthy host that has the model loaded (it served
+    the model in the last ``affinity_ttl`` seconds) unless all of those are
+    busy with ``spill_at`` calls or more, then to a host that has the model
+    installed, then to any healthy host. Among those the ``strategy`` picks:
+    "least_outstanding" (fewest calls in flight, then lowest latency) or
+    "ewma" (lowest latency EWMA scaled by the calls in flight).
+    
+    A host is ejected after ``eject_after`` consecutive failures (refused
+    connections, timeouts, failed probes). A daemon thread probes every host
+    through /api/tags each ``probe_interval`` seconds, re-admitting ejected
+    hosts that answer and refreshing which models each host has. If every
+    host is ejected, calls are spread over all of them rather than refused.
+    """
+    
+    def __init__(self, urls, strategy="least_outstanding", probe_interval=10.0, probe_timeout=2.0, eject_after=2,
+                 ewma_alpha=0.3, affinity_ttl=1800, spill_at=2):
+        if isinstance(urls, str):
+            urls = urls.split(",")
+        if strategy not in ("least_outstanding", "ewma"):
+            raise ValueError(f"Unknown strategy: {strategy}")
+        self.endpoints = [Endpoint(url) for url in urls if url.strip()]
+        if not self.endpoints:
+            raise ValueError("EndpointPool needs at least one URL")
+        self.strategy = strategy
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.eject_after = eject_after
+        self.ewma_alpha = ewma_alpha
+        self.affinity_ttl = affinity_ttl
+        self.spill_at = spill_at
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._probe_thread = None
+        self._probe_stop = threading.Event()
+    
+    def _load(self, endpoint):
+        if self.strategy == "ewma":
+            return ((endpoint.ewma_ms or 0.0) * (endpoint.outstanding + 1), endpoint.outstanding)
+        return (endpoint.outstanding, endpoint.ewma_ms or 0.0)
+    
+    def choose(self, model=None, exclude=()):
+        """Reserve the best endpoint for a call to ``model``; pair with finish()
+        
+        Endpoints in ``exclude`` (e.g. ones a retry already failed on) are
+        only used when nothing else is left.
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy and e not in exclude]
+            if not candidates:
+                candidates = [e for e in self.endpoints if e.healthy] or list(self.endpoints)
+            
+            if model is not None:
+                now = time.monotonic()
+                loaded = [e for e in candidates if now - e.loaded.get(model, -self.affinity_ttl) < self.affinity_ttl]
+                idle_loaded = [e for e in loaded if e.outstanding < self.spill_at]
+                installed = [e for e in candidates if e.has_model(model)]
+                candidates = idle_loaded or installed or candidates
+            
+            endpoint = min(candidates, key=self._load)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+    
+    def finish(self, endpoint, latency_ms=None, model=None, ok=True):
+        """Release an endpoint reserved by choose(), recording how the call went
+        
+        ``ok`` is False when the host could not be reached at all; busy or
+        error responses still count as the host being up.
+        """
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            if ok:
+                endpoint.failures = 0
+                if latency_ms is not None:
+                    if endpoint.ewma_ms is None:
+                        endpoint.ewma_ms = latency_ms
+                    else:
+                        endpoint.ewma_ms += self.ewma_alpha * (latency_ms - endpoint.ewma_ms)
+                if model is not None:
+                    endpoint.loaded[model] = time.monotonic()
+            else:
+                self._failed(endpoint)
+    
+    def lacks(self, endpoint, model):
+        """Note that ``endpoint`` answered "model not found" for ``model``"""
+        with self._lock:
+            if endpoint.models is None:
+                endpoint.models = set()
+            endpoint.models.discard(model)
+            endpoint.models.discard(f"{model}:latest")
+            endpoint.loaded.pop(model, None)
+    
+    def _failed(self, endpoint):
+        endpoint.failures += 1
+        if endpoint.healthy and endpoint.failures >= self.eject_after:
+            endpoint.healthy = False
+            endpoint.loaded = {}
+            print(f"Ejected Ollama endpoint {endpoint.url} after {endpoint.failures} failures")
+    
+    def probe(self, endpoint):
+        """Check one endpoint through /api/tags; returns whether it answered"""
+        try:
+            response = self._session.get(f"{endpoint.url}/tags", timeout=self.probe_timeout)
+            ok = response.status_code == 200
+            models = {model["name"] for model in response.json().get("models", [])} if ok else None
+        except (requests.RequestException, ValueError):
+            ok = False
+            models = None
+        
+        with self._lock:
+            if not ok:
+                self._failed(endpoint)
+                return False
+            endpoint.models = models
+            endpoint.failures = 0
+            if not endpoint.healthy:
+                endpoint.healthy = True
+                print(f"Re-admitted Ollama endpoint {endpoint.url}")
+            return True
+    
+    def probe_all(self):
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+    
+    def start_probes(self):
+        """Probe every endpoint now and then every ``probe_interval`` seconds on a daemon thread"""
+        if self._probe_thread is not None:
+            return
+        
+        def run():
+            while True:
+                self.probe_all()
+                if self._probe_stop.wait(self.probe_interval):
+                    break
+            self._probe_thread = None
+        
+        self._probe_stop.clear()
+        self._probe_thread = threading.Thread(target=run)
+        self._probe_thread.daemon = True
+        self._probe_thread.start()
+    
+    def stop_probes(self):
+        self._probe_stop.set()
+    
+    def stats(self):
+        with self._lock:
+            return [endpoint.snapshot() for endpoint in self.endpoints]
+    
+    def close(self):
+        self.stop_probes()
+        self._session.close()
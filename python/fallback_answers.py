@@ -0,0 +1,43 @@
+import re
+import threading
+
+from lru_cache import LRUCache
+
+# Said when the model misses its deadline and there is no earlier answer to reuse
+CANNED = (
+    "Sorry, I'm taking too long to think about that. Could you ask me again in a moment?",
+    "Give me a second, my thoughts are running slow right now. Try asking me again.",
+    "I couldn't come up with an answer in time. Let's try that once more."
+)
+
+class FallbackAnswers:
+    """Fast answers for calls that miss their deadline
+    
+    Real answers are remembered by their normalized question (the prompt,
+    or the last user message of a chat), so a repeated question gets its
+    last real answer back; anything else gets the next canned reply.
+    """
+    
+    def __init__(self, canned=CANNED, size=256):
+        self.canned = list(canned)
+        self.recent = LRUCache(size)
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(question):
+        return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", "", question.lower())).strip()
+    
+    def remember(self, question, answer):
+        if question and answer and not answer.startswith("Error:"):
+            self.recent.put(self.normalize(question), answer)
+    
+    def answer(self, question):
+        """Return (text, source), where source is either 'cached' or 'canned'"""
+        cached = self.recent.get(self.normalize(question or ""))
+        if cached is not None:
+            return cached, "cached"
+        with self._lock:
+            text = self.canned[self._next % len(self.canned)]
+            self._next += 1
+        return text, "canned"
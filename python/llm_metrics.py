@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+# Histogram bucket upper bounds: 1-2-5 steps from 1 to 5,000,000 (ms, tokens or tokens/s)
+BUCKETS = [scale * step for scale in (1, 10, 100, 1000, 10000, 100000, 1000000) for step in (1, 2, 5)]
+
+# Timings Ollama reports with a finished call (see OllamaInterface._record_stats)
+TIMINGS = ("total_ms", "load_ms", "prompt_eval_ms", "eval_ms", "first_token_ms")
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum, min and max"""
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+    
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+    
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of values (capped at the max seen)"""
+        if self.count == 0:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                bound = BUCKETS[index] if index < len(BUCKETS) else self.max
+                return min(bound, self.max)
+        return self.max
+    
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max
+        }
+
+class MetricsRegistry:
+    """In-process registry of per-call LLM metrics, keyed by (caller, model)
+    
+    Each finished call adds its timings, token counts and throughput
+    (tokens per second) to histograms for its caller and model; counters
+    track calls, tokens, cache hits, errors, hedges and deadline hits.
+    query() summarizes them and start_dump() writes the summary to a file
+    every ``interval`` seconds.
+    """
+    
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+        self._dump_thread = None
+        self._dump_stop = threading.Event()
+    
+    def _get_series(self, caller, model):
+        key = (caller or "default", model or "unknown")
+        series = self._series.get(key)
+        if series is None:
+            series = {"histograms": {}, "counters": {}}
+            self._series[key] = series
+        return series
+    
+    def _observe(self, series, name, value):
+        histogram = series["histograms"].get(name)
+        if histogram is None:
+            histogram = series["histograms"][name] = Histogram()
+        histogram.add(value)
+    
+    def record(self, caller, model, stats):
+        """Add one call's stats (as kept in OllamaInterface.last_stats)"""
+        with self._lock:
+            series = self._get_series(caller, model)
+            counters = series["counters"]
+            counters["calls"] = counters.get("calls", 0) + 1
+            for name in TIMINGS:
+                if stats.get(name) is not None:
+                    self._observe(series, name, stats[name])
+            
+            # Streams cut short only report their time to first token
+            if "eval_count" in stats:
+                counters["prompt_tokens"] = counters.get("prompt_tokens", 0) + stats["prompt_eval_count"]
+                counters["eval_tokens"] = counters.get("eval_tokens", 0) + stats["eval_count"]
+                self._observe(series, "prompt_tokens", stats["prompt_eval_count"])
+                self._observe(series, "eval_tokens", stats["eval_count"])
+                if stats["eval_ms"] > 0:
+                    self._observe(series, "eval_tokens_per_s", stats["eval_count"] / stats["eval_ms"] * 1000)
+                if stats["prompt_eval_ms"] > 0:
+                    self._observe(series, "prompt_tokens_per_s",
+                                  stats["prompt_eval_count"] / stats["prompt_eval_ms"] * 1000)
+    
+    def count(self, caller, model, name, amount=1):
+        """Bump a named counter (e.g. "cache_hits", "errors")"""
+        with self._lock:
+            counters = self._get_series(caller, model)["counters"]
+            counters[name] = counters.get(name, 0) + amount
+    
+    def percentile(self, caller, model, name, fraction, min_count=1):
+        """One histogram's percentile (e.g. 0.95 of "total_ms"), or None with fewer than ``min_count`` values"""
+        with self._lock:
+            series = self._series.get((caller or "default", model or "unknown"))
+            histogram = series["histograms"].get(name) if series is not None else None
+            if histogram is None or histogram.count < min_count:
+                return None
+            return histogram.percentile(fraction)
+    
+    def query(self, caller=None, model=None):
+        """Summaries for every series matching ``caller`` and/or ``model`` (None matches all)"""
+        with self._lock:
+            results = []
+            for (series_caller, series_model), series in sorted(self._series.items()):
+                if caller is not None and series_caller != caller:
+                    continue
+                if model is not None and series_model != model:
+                    continue
+                results.append({
+                    "caller": series_caller,
+                    "model": series_model,
+                    "counters": dict(series["counters"]),
+                    "histograms": {name: histogram.summary() for name, histogram in series["histograms"].items()}
+                })
+            return results
+    
+    def dump(self, path):
+        """Write the current summaries to ``path`` as JSON (atomically)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"timestamp": time.time(), "series": self.query()}, f, indent=2)
+        os.replace(tmp_path, path)
+    
+    def start_dump(self, path=None, interval=60.0):
+        """Dump to ``path`` every ``interval`` seconds on a daemon thread"""
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), "HumanAI", "llm_metrics.json")
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if self._dump_thread is not None:
+            return
+        
+        def run():
+            while not self._dump_stop.wait(interval):
+                try:
+                    self.dump(path)
+                except Exception as e:
+                    print(f"Error writing LLM metrics: {str(e)}")
+            self._dump_thread = None
+        
+        self._dump_stop.clear()
+        self._dump_thread = threading.Thread(target=run)
+        self._dump_thread.daemon = True
+        self._dump_thread.start()
+    
+    def stop_dump(self):
+        self._dump_stop.set()
+    
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+# Shared by every OllamaInterface unless one is given its own
+default_registry = MetricsRegistry()
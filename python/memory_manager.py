@@ -1,10 +1,55 @@
 import os
+import sys
 import json
+import glob
+import shutil
 import datetime
 import time
+import heapq
+import math
+import uuid
+import threading
+import base64
+import concurrent.futures
+
+from memory_store import MemoryLog, MemoryArchive, replace_file
+from lru_cache import LRUCache
+from memory_text_index import TextIndex
+from memory_tag_index import TagIndex
+from memory_vectors import VectorIndex, NUMPY_AVAILABLE
+
+# base64.b32encode output translated to Crockford's alphabet, as used by ULIDs
+CROCKFORD_BASE32 = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", b"0123456789ABCDEFGHJKMNPQRSTVWXYZ")
+
+_id_lock = threading.Lock()
+_last_id = (0, 0)
+
+def new_memory_id(timestamp=None):
+    """Monotonic, collision-free memory id: "memory_" + a 26-character ULID
+    
+    48 bits of millisecond time followed by 80 random bits. Within one
+    millisecond the random part is incremented, so ids from one process
+    always sort in creation order and never repeat; across processes the
+    random bits make collisions practically impossible.
+    """
+    global _last_id
+    millis = int((timestamp if timestamp is not None else time.time()) * 1000)
+    with _id_lock:
+        last_millis, last_random = _last_id
+        if millis <= last_millis:
+            millis, randomness = last_millis, last_random + 1
+        else:
+            randomness = int.from_bytes(os.urandom(10), "big")
+        _last_id = (millis, randomness)
+    
+    value = (millis << 80) | (randomness & ((1 << 80) - 1))
+    # 20 bytes encode to 32 characters; the last 26 carry the 128-bit value
+    encoded = base64.b32encode(value.to_bytes(20, "big"))[6:].translate(CROCKFORD_BASE32)
+    return "memory_" + encoded.decode("ascii")
 
 class MemoryManager:
-    def __init__(self, memory_dir=None):
+    def __init__(self, memory_dir=None, store=None, checkpoint_every=500, embedder=None, use_ivf=False,
+                 record_cache_size=2048, refresh_interval=1.0, retention_days=None):
         # Use user's home directory if no specific directory is provided
         if memory_dir is None:
             home_dir = os.path.expanduser("~")
@@ -16,52 +61,418 @@ class MemoryManager:
         if not os.path.exists(self.memory_dir):
             os.makedirs(self.memory_dir)
         
-        # Create index file if it doesn't exist
+        # The index file is a checkpoint of the in-memory index; the log is the source of truth
         self.index_file = os.path.join(self.memory_dir, "memory_index.json")
-        if not os.path.exists(self.index_file):
-            with open(self.index_file, "w") as f:
-                json.dump({"memories": []}, f)
+        self.log_file = os.path.join(self.memory_dir, "memories.jsonl")
+        self.checkpoint_every = checkpoint_every
+        
+        # Memories older than retention_days move to the compressed archive (see apply_retention)
+        self.archive = MemoryArchive(os.path.join(self.memory_dir, "memory_archive.bin"))
+        self.retention_days = retention_days
+        
+        legacy_index = self._read_legacy_index()
+        
+        self.store = store or MemoryLog(self.log_file)
+        # Every write (log, vectors, checkpoint) happens under this inter-process lock
+        self.lock = self.store.lock
+        
+        # Semantic recall is enabled by passing an embedder (see memory_vectors.py)
+        self.embedder = embedder
+        self.use_ivf = use_ivf
+        self.vectors = None
+        if embedder is not None and not NUMPY_AVAILABLE:
+            print("numpy is not installed; semantic memory search is disabled")
+        
+        # id -> index entry (timestamp, tags, preview and the record's location in the log)
+        self._entries = {}
+        self.text_index = TextIndex()
+        self.tag_index = TagIndex()
+        self._next_doc = 0
+        self._log_size = 0
+        self._log_identity = None
+        self._unsaved_appends = 0
+        
+        # Decoded records, keyed by (id, offset) so a rewritten record is never served stale
+        self._records = LRUCache(record_cache_size)
+        self._archive_blocks = LRUCache(16)
+        self.refresh_interval = refresh_interval
+        self._last_refresh = time.monotonic()
+        self._index_refreshes = 0
+        self._index_reloads = 0
+        
+        # Bumped whenever a log record is applied; per-turn context caches are keyed on it
+        self._generation = 0
+        self._recent_cache = (None, [])
+        self._context_cache = {}
+        self._snippets = {}
+        # Embeddings of recent turn inputs; the embedder runs on its own thread so a turn can stop waiting
+        self._query_vectors = LRUCache(256)
+        self._embed_pool = None
+        self._load_index()
+        
+        if legacy_index is not None:
+            self.migrate_legacy_layout(legacy_index)
+        if self.retention_days is not None:
+            self.apply_retention()
     
-    def save_memory(self, content, tags=None):
-        """Save a memory to the memory store with optional tags"""
+    def _read_legacy_index(self):
+        """Return the pre-log index ({"memories": [...]}) if this directory still uses it"""
         try:
-            # Load current index
-            with open(self.index_file, "r") as f:
-                index = json.load(f)
-            
-            # Create memory entry
-            timestamp = time.time()
-            date_str = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d_%H-%M-%S")
-            memory_id = f"memory_{date_str}"
-            memory_file = os.path.join(self.memory_dir, f"{memory_id}.json")
-            
-            # Create memory data
-            memory_data = {
-                "id": memory_id,
-                "timestamp": timestamp,
-                "date": date_str,
-                "content": content,
-                "tags": tags or []
+            if os.path.exists(self.index_file):
+                with open(self.index_file, "r") as f:
+                    index = json.load(f)
+                if isinstance(index, dict) and "version" not in index:
+                    return index
+        except Exception as e:
+            print(f"Error reading memory index: {str(e)}")
+        return None
+    
+    def _make_entry(self, memory, offset, length):
+        content = memory["content"]
+        return {
+            "id": memory["id"],
+            "timestamp": memory["timestamp"],
+            "date": memory["date"],
+            "tags": memory["tags"],
+            "preview": content[:100] + "..." if len(content) > 100 else content,
+            "offset": offset,
+            "length": length,
+            "archive": None,
+            "vector_row": None
+        }
+    
+    def _set_vector_row(self, entry, vector_row):
+        if self.vectors is not None:
+            self.vectors.invalidate(entry.get("vector_row"))
+            if vector_row is not None:
+                self.vectors.register(vector_row, entry["id"])
+        entry["vector_row"] = vector_row
+    
+    def _apply_record(self, offset, length, record):
+        """Update the in-memory index for one log record"""
+        self._generation += 1
+        op = record.get("op")
+        if op == "put":
+            self._index_memory(record["memory"], offset, length, record.get("vector_row"))
+        elif op == "archive_block":
+            # Memories moved to the cold tier; the block itself lives in the archive file
+            location = [record["offset"], record["length"]]
+            memories = self._read_archive_block(location)
+            vector_rows = record.get("vector_rows") or [None] * len(record["ids"])
+            for memory_id, vector_row in zip(record["ids"], vector_rows):
+                memory = memories.get(memory_id)
+                if memory is None:
+                    print(f"Archived memory {memory_id} is missing from its block")
+                    continue
+                self._index_memory(memory, offset, length, vector_row, archive=location)
+        elif op == "vector":
+            entry = self._entries.get(record["id"])
+            if entry is not None:
+                self._set_vector_row(entry, record["vector_row"])
+        elif op == "vectors_reset":
+            for entry in self._entries.values():
+                self._set_vector_row(entry, None)
+        elif op == "delete":
+            for memory_id in record["ids"]:
+                entry = self._entries.pop(memory_id, None)
+                if entry is None:
+                    continue
+                self._set_vector_row(entry, None)
+                self.tag_index.remove(entry["doc"], entry["tags"])
+                self._snippets.pop(memory_id, None)
+                try:
+                    self.text_index.remove(memory_id, self._read(entry)["content"])
+                except Exception:
+                    self.text_index.remove(memory_id)
+        elif op == "clear":
+            for entry in self._entries.values():
+                self._set_vector_row(entry, None)
+            self._entries = {}
+            self.text_index = TextIndex()
+            self.tag_index = TagIndex()
+            self._snippets = {}
+    
+    def _index_memory(self, memory, offset, length, vector_row, archive=None):
+        self._snippets.pop(memory["id"], None)
+        previous = self._entries.get(memory["id"])
+        if previous is not None:
+            self._set_vector_row(previous, None)
+            self.tag_index.remove(previous["doc"], previous["tags"])
+        entry = self._make_entry(memory, offset, length)
+        entry["archive"] = archive
+        entry["doc"] = self._next_doc
+        self._next_doc += 1
+        self._entries[memory["id"]] = entry
+        self._set_vector_row(entry, vector_row)
+        self.text_index.add(memory["id"], memory["content"])
+        self.tag_index.add(entry["doc"], memory["id"], memory["tags"])
+    
+    def _read_archive_block(self, location):
+        key = tuple(location)
+        memories = self._archive_blocks.get(key)
+        if memories is None:
+            memories = self.archive.read_block(*key)
+            self._archive_blocks.put(key, memories)
+        return memories
+    
+    def _vector_base(self):
+        # Compaction writes a new vector file and names it in the new log's header
+        return os.path.join(self.memory_dir, self.store.header.get("vectors", "memory_vectors"))
+    
+    def _reset_index(self):
+        self._entries = {}
+        self.text_index = TextIndex()
+        self.tag_index = TagIndex()
+        self._next_doc = 0
+        if self.embedder is not None and NUMPY_AVAILABLE:
+            self.vectors = VectorIndex(self._vector_base(), use_ivf=self.use_ivf)
+        self._records.clear()
+        self._archive_blocks.clear()
+        self._snippets = {}
+        self._generation += 1
+    
+    def _load_index(self):
+        """Load the index checkpoint, then replay whatever the log gained since"""
+        self._reset_index()
+        start = self.store.header_size
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, "r") as f:
+                    checkpoint = json.load(f)
+                if (isinstance(checkpoint, dict) and checkpoint.get("log_id") == self.store.log_id
+                        and checkpoint.get("log_size", 0) <= self.store.size()
+                        and "text_index" in checkpoint and "next_doc" in checkpoint):
+                    self._entries = {entry["id"]: entry for entry in checkpoint["memories"]}
+                    self.text_index = TextIndex.from_dict(checkpoint["text_index"])
+                    self._next_doc = checkpoint["next_doc"]
+                    # Tag bitsets are cheap to rebuild from the entries, so they are not stored
+                    for entry in self._entries.values():
+                        self.tag_index.add(entry["doc"], entry["id"], entry["tags"])
+                    start = max(start, checkpoint["log_size"])
+                    if self.vectors is not None:
+                        for entry in self._entries.values():
+                            if entry.get("vector_row") is not None:
+                                self.vectors.register(entry["vector_row"], entry["id"])
+        except Exception as e:
+            print(f"Error loading memory index checkpoint, rebuilding from log: {str(e)}")
+            self._reset_index()
+            start = self.store.header_size
+        
+        self._log_identity = self.store.identity()[:2]
+        self._log_size = start
+        if self._replay() >= self.checkpoint_every:
+            self.checkpoint()
+    
+    def _replay(self):
+        """Apply every log record past the part of the log already indexed"""
+        replayed = 0
+        for offset, length, record in self.store.scan(self._log_size):
+            self._apply_record(offset, length, record)
+            self._log_size = offset + length
+            replayed += 1
+        return replayed
+    
+    def _refresh(self, force=False):
+        """Pick up records written by other processes since the index was last checked
+        
+        The log is only stat()ed once per ``refresh_interval`` seconds unless
+        forced, so repeated reads within a turn stay in memory.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        
+        inode, device, size = self.store.identity()
+        if (inode, device) != self._log_identity or size < self._log_size:
+            # The log was replaced (compaction, migration): rebuild from its checkpoint
+            self.store.reopen()
+            self._load_index()
+            self._index_reloads += 1
+        elif size > self._log_size:
+            self._replay()
+            self._index_refreshes += 1
+    
+    def checkpoint(self):
+        """Persist the in-memory index so the next start only replays the log tail"""
+        try:
+            checkpoint = {
+                "version": 2,
+                "log_id": self.store.log_id,
+                "log_size": self._log_size,
+                "memories": list(self._entries.values()),
+                "text_index": self.text_index.to_dict(),
+                "next_doc": self._next_doc
             }
+            tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                # json.dumps uses the C encoder; json.dump streams through the slow Python one
+                f.write(json.dumps(checkpoint, separators=(",", ":")))
+            with self.lock:
+                replace_file(tmp_file, self.index_file)
+            self._unsaved_appends = 0
+            return True
+        except Exception as e:
+            print(f"Error writing memory index checkpoint: {str(e)}")
+            return False
+    
+    def _append(self, records, vectors=None, checkpoint=True):
+        """Append records (and their embeddings, if given) as one locked write
+        
+        Holding the lock, the index is first brought up to date with other
+        writers' records, so offsets and vector rows can never collide.
+        """
+        with self.lock:
+            self._refresh(force=True)
+            if vectors is not None:
+                for record, row in zip(records, self._append_vectors(vectors)):
+                    record["vector_row"] = row
             
-            # Save memory to file
-            with open(memory_file, "w") as f:
-                json.dump(memory_data, f, indent=2)
+            locations = self.store.append_many(records)
+            for (offset, length), record in zip(locations, records):
+                self._apply_record(offset, length, record)
+                self._log_size = offset + length
             
-            # Update index
-            index["memories"].append({
-                "id": memory_id,
-                "timestamp": timestamp,
-                "date": date_str,
-                "tags": tags or [],
-                "preview": content[:100] + "..." if len(content) > 100 else content
-            })
+            self._unsaved_appends += len(records)
+            if checkpoint and self._unsaved_appends >= self.checkpoint_every:
+                self.checkpoint()
+    
+    def _embed(self, texts):
+        """Embed texts (no disk I/O); None where embedding is off or failed"""
+        if self.vectors is None:
+            return None
+        
+        vectors = []
+        for text in texts:
+            try:
+                vectors.append(self.embedder.embed(text) or None)
+            except Exception as e:
+                print(f"Error embedding memory, saving without vector: {str(e)}")
+                vectors.append(None)
+        return vectors
+    
+    def _append_vectors(self, vectors):
+        """Append embeddings to the vector file (lock held); returns rows, None where missing"""
+        rows = [None] * len(vectors)
+        if self.vectors is None:
+            return rows
+        try:
+            present = [i for i, vector in enumerate(vectors) if vector is not None]
+            appended = self.vectors.append_many([vectors[i] for i in present])
+            for i, row in zip(present, appended):
+                rows[i] = row
+        except Exception as e:
+            print(f"Error storing memory vectors, saving without them: {str(e)}")
+        return rows
+    
+    def _read(self, entry):
+        archive = entry.get("archive")
+        key = (entry["id"], entry["offset"]) if archive is None else (entry["id"], "archive", archive[0])
+        memory = self._records.get(key)
+        if memory is None:
+            if archive is None:
+                memory = self.store.read_at(entry["offset"], entry["length"])["memory"]
+            else:
+                memory = self._read_archive_block(archive)[entry["id"]]
+            self._records.put(key, memory)
+        return dict(memory)
+    
+    def migrate_legacy_layout(self, legacy_index=None):
+        """Move a one-file-per-memory directory into the log (one-shot)
+        
+        Every memory_*.json file is appended to the log in timestamp order and
+        the old files are moved into a "legacy" subdirectory rather than deleted.
+        """
+        try:
+            with self.lock:
+                # Another process may have finished the migration while this one started
+                if legacy_index is not None and self._read_legacy_index() is None:
+                    return 0
+                
+                legacy_files = [path for path in glob.glob(os.path.join(self.memory_dir, "memory_*.json"))
+                                if os.path.basename(path) != "memory_index.json"]
+                
+                memories = []
+                for path in legacy_files:
+                    try:
+                        with open(path, "r") as f:
+                            memories.append(json.load(f))
+                    except Exception as e:
+                        print(f"Skipping unreadable memory file {path}: {str(e)}")
+                memories.sort(key=lambda x: x["timestamp"])
+                
+                if memories:
+                    self._append([{"op": "put", "memory": memory} for memory in memories],
+                                 self._embed([memory["content"] for memory in memories]))
+                
+                legacy_dir = os.path.join(self.memory_dir, "legacy")
+                os.makedirs(legacy_dir, exist_ok=True)
+                for path in legacy_files:
+                    shutil.move(path, os.path.join(legacy_dir, os.path.basename(path)))
+                if legacy_index is not None and os.path.exists(self.index_file):
+                    shutil.move(self.index_file, os.path.join(legacy_dir, "memory_index.json"))
+                
+                self.checkpoint()
+            print(f"Migrated {len(memories)} memories to {self.log_file}")
+            return len(memories)
+        except Exception as e:
+            print(f"Error migrating legacy memories: {str(e)}")
+            return 0
+    
+    def _new_memory(self, content, tags=None, timestamp=None):
+        timestamp = timestamp if timestamp is not None else time.time()
+        return {
+            "id": new_memory_id(timestamp),
+            "timestamp": timestamp,
+            "date": datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d_%H-%M-%S"),
+            "content": content,
+            "tags": tags or []
+        }
+    
+    def save_memories_bulk(self, items, batch_size=5000, embed=True):
+        """Import many memories at once
+        
+        ``items`` may be any iterable (it is consumed in batches) of strings
+        or dicts with "content" and optional "tags" and "timestamp". The whole
+        import holds the write lock, each batch is a single log write, and the
+        index checkpoint is written once at the end.
+        
+        Returns (success, list of new memory ids).
+        """
+        memory_ids = []
+        try:
+            with self.lock:
+                batch = []
+                for item in items:
+                    if isinstance(item, str):
+                        item = {"content": item}
+                    batch.append(self._new_memory(item["content"], item.get("tags"), item.get("timestamp")))
+                    if len(batch) >= batch_size:
+                        self._save_batch(batch, embed)
+                        memory_ids.extend(memory["id"] for memory in batch)
+                        batch = []
+                if batch:
+                    self._save_batch(batch, embed)
+                    memory_ids.extend(memory["id"] for memory in batch)
+                self.checkpoint()
+            return True, memory_ids
+        except Exception as e:
+            print(f"Error importing memories ({len(memory_ids)} saved): {str(e)}")
+            return False, memory_ids
+    
+    def _save_batch(self, memories, embed):
+        vectors = self._embed([memory["content"] for memory in memories]) if embed else None
+        self._append([{"op": "put", "memory": memory} for memory in memories], vectors, checkpoint=False)
+    
+    def save_memory(self, content, tags=None):
+        """Save a memory to the memory store with optional tags"""
+        try:
+            memory_data = self._new_memory(content, tags)
             
-            # Save updated index
-            with open(self.index_file, "w") as f:
-                json.dump(index, f, indent=2)
+            # Append to the log; the index is updated in memory and checkpointed periodically
+            self._append([{"op": "put", "memory": memory_data}], self._embed([content]))
             
-            return True, memory_id
+            return True, memory_data["id"]
         except Exception as e:
             print(f"Error saving memory: {str(e)}")
             return False, None
@@ -69,77 +480,545 @@ class MemoryManager:
     def get_memory(self, memory_id):
         """Retrieve a specific memory by ID"""
         try:
-            memory_file = os.path.join(self.memory_dir, f"{memory_id}.json")
-            if os.path.exists(memory_file):
-                with open(memory_file, "r") as f:
-                    return json.load(f)
+            self._refresh()
+            entry = self._entries.get(memory_id)
+            if entry is not None:
+                return self._read(entry)
             return None
         except Exception as e:
             print(f"Error retrieving memory: {str(e)}")
             return None
     
-    def search_memories(self, query=None, tags=None, limit=5):
-        """Search memories by content or tags"""
+    def search_memories(self, query=None, tags=None, limit=5, all_tags=None, exclude_tags=None):
+        """Search memories by content (BM25 ranked) and/or tags
+        
+        ``tags`` matches memories with any of the tags, ``all_tags`` those with
+        every one and ``exclude_tags`` drops memories with any of them. A query
+        combined with tag filters only returns memories matching both; tag
+        filters alone return the newest matching memories.
+        """
         try:
-            # Load index
-            with open(self.index_file, "r") as f:
-                index = json.load(f)
+            self._refresh()
+            allowed = None
+            if tags or all_tags or exclude_tags:
+                allowed = self.tag_index.ids(self.tag_index.query(tags, all_tags, exclude_tags))
+            
+            if query:
+                # Only memories sharing a token with the query are touched
+                matched_ids = [memory_id for memory_id, score in
+                               self.text_index.search(query, limit, None if allowed is None else set(allowed))]
+            elif allowed is not None:
+                newest = heapq.nlargest(limit, (self._entries[memory_id] for memory_id in allowed),
+                                        key=lambda x: x["timestamp"])
+                matched_ids = [entry["id"] for entry in newest]
+            else:
+                matched_ids = []
+            
+            return [self._read(self._entries[memory_id]) for memory_id in matched_ids]
+        except Exception as e:
+            print(f"Error searching memories: {str(e)}")
+            return []
+    
+    def _phrase_matches(self, phrase):
+        """Ids of the memories whose content contains ``phrase``, ignoring case"""
+        phrase = phrase.lower().strip()
+        candidates = self.text_index.match_all(phrase)
+        if candidates is None:
+            candidates = list(self._entries)
+        return [memory_id for memory_id in candidates
+                if memory_id in self._entries and phrase in self._read(self._entries[memory_id])["content"].lower()]
+    
+    def find_memories(self, phrase, limit=None):
+        """Memories whose content contains ``phrase`` (ignoring case), newest first
+        
+        Unlike search_memories this is an exact match rather than a ranking,
+        so it is what destructive commands should use to pick their targets.
+        The text index narrows the candidates to memories with every word.
+        """
+        try:
+            self._refresh()
+            entries = [self._entries[memory_id] for memory_id in self._phrase_matches(phrase)]
+            entries.sort(key=lambda x: x["timestamp"], reverse=True)
+            if limit is not None:
+                entries = entries[:limit]
+            return [self._read(entry) for entry in entries]
+        except Exception as e:
+            print(f"Error finding memories: {str(e)}")
+            return []
+    
+    def semantic_search(self, query, k=5, min_score=None):
+        """Find the k memories closest in meaning to the query (cosine similarity)
+        
+        Falls back to text search when no embedder is configured.
+        """
+        try:
+            self._refresh()
+            if self.vectors is None:
+                return self.search_memories(query=query, limit=k)
+            
+            query_vector = self.embedder.embed(query)
+            if not query_vector:
+                return self.search_memories(query=query, limit=k)
             
             results = []
-            for memory_entry in index["memories"]:
-                # Check if memory matches search criteria
-                memory_file = os.path.join(self.memory_dir, f"{memory_entry['id']}.json")
-                
-                if not os.path.exists(memory_file):
-                    continue
-                
-                with open(memory_file, "r") as f:
-                    memory = json.load(f)
+            for memory_id, score in self.vectors.search(query_vector, k):
+                if min_score is not None and score < min_score:
+                    break
+                entry = self._entries.get(memory_id)
+                if entry is not None:
+                    results.append(self._read(entry))
+            return results
+        except Exception as e:
+            print(f"Error in semantic memory search: {str(e)}")
+            return []
+    
+    def reindex_vectors(self):
+        """Re-embed every memory, e.g. after switching to a different embedder"""
+        if self.vectors is None:
+            return 0
+        try:
+            with self.lock:
+                self._refresh(force=True)
+                self.vectors.reset()
+                self._append([{"op": "vectors_reset"}])
                 
-                # Match by query (simple text search)
-                if query and query.lower() in memory["content"].lower():
-                    results.append(memory)
+                entries = list(self._entries.values())
+                vectors = self._embed([self._read(entry)["content"] for entry in entries])
+                records = [{"op": "vector", "id": entry["id"]} for entry in entries]
+                if records:
+                    self._append(records, vectors)
+            return sum(1 for record in records if record.get("vector_row") is not None)
+        except Exception as e:
+            print(f"Error re-embedding memories: {str(e)}")
+            return 0
+    
+    def build_vector_clusters(self, n_lists=None):
+        """Switch semantic search to clustered (IVF) mode for very large memory stores"""
+        if self.vectors is None:
+            return False
+        return self.vectors.build_ivf(n_lists=n_lists)
+    
+    def _recent_entries(self, limit):
+        """Newest index entries, recomputed only after a memory was saved"""
+        generation, recent = self._recent_cache
+        if generation != self._generation or len(recent) < min(limit, len(self._entries)):
+            recent = heapq.nlargest(max(limit, 20), self._entries.values(), key=lambda x: x["timestamp"])
+            self._recent_cache = (self._generation, recent)
+        return recent[:limit]
+    
+    def _snippet(self, memory_id, max_chars):
+        """Shortened memory content, read from the log once and then kept in memory"""
+        snippet = self._snippets.get(memory_id)
+        if snippet is None:
+            content = self._read(self._entries[memory_id])["content"]
+            snippet = content[:max_chars] + "..." if len(content) > max_chars else content
+            self._snippets[memory_id] = snippet
+        return snippet
+    
+    def _query_vector(self, text, timeout):
+        """Embedding of a turn's input, or None when it is not ready within ``timeout`` seconds
+        
+        A late embedding is still cached, so repeating the input uses it.
+        """
+        vector = self._query_vectors.get(text)
+        if vector is not None:
+            return vector
+        if self._embed_pool is None:
+            self._embed_pool = concurrent.futures.ThreadPoolExecutor(1)
+        
+        def embed():
+            vector = self.embedder.embed(text)
+            if vector:
+                self._query_vectors.put(text, vector)
+            return vector
+        
+        try:
+            return self._embed_pool.submit(embed).result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+    
+    def get_context_memories(self, user_input, max_chars=600, max_tokens=None, recent_candidates=10,
+                             relevance_weight=0.7, recency_weight=0.3, snippet_chars=200, min_similarity=0.5,
+                             embed_timeout=0.5):
+        """Pick the memories most worth putting in the prompt for this user input
+        
+        Candidates are the best text matches and, with an embedder, the
+        memories at least ``min_similarity`` close in meaning; memories that
+        match in neither way are never used, however new. Each is scored as
+        a weighted mix of relevance and recency, and the best ones are taken
+        until the character budget (about 4 characters per token when
+        ``max_tokens`` is given) is used up. The input is embedded at most
+        ``embed_timeout`` seconds; a slower embedder only costs this turn its
+        semantic matches. Results are cached until the next save, so repeated
+        turns do no disk I/O.
+        
+        Returns a list of {"id", "timestamp", "tags", "snippet", "relevance",
+        "score"} dicts.
+        """
+        try:
+            self._refresh()
+            if max_tokens is not None:
+                max_chars = min(max_chars, max_tokens * 4)
+            
+            cache_key = (user_input, max_chars, recent_candidates, relevance_weight, recency_weight, snippet_chars,
+                         min_similarity)
+            cached = self._context_cache.get(cache_key)
+            if cached is not None and cached[0] == self._generation:
+                return cached[1]
+            
+            relevance = {}
+            lexical = self.text_index.search(user_input, limit=recent_candidates) if user_input else []
+            if lexical:
+                best = lexical[0][1] or 1.0
+                for memory_id, score in lexical:
+                    relevance[memory_id] = score / best
+            
+            complete = True
+            if self.vectors is not None and user_input:
+                query_vector = self._query_vector(user_input, embed_timeout)
+                if query_vector:
+                    for memory_id, score in self.vectors.search(query_vector, recent_candidates):
+                        if score >= min_similarity:
+                            relevance[memory_id] = max(relevance.get(memory_id, 0.0), score)
+                else:
+                    complete = False
+            
+            # Recency only orders relevant memories; it never adds a memory by itself
+            recency = {}
+            for rank, entry in enumerate(self._recent_entries(recent_candidates)):
+                recency[entry["id"]] = math.exp(-rank / 3.0)
+            
+            scored = []
+            for memory_id, match in relevance.items():
+                if match <= 0 or memory_id not in self._entries:
                     continue
-                
-                # Match by tags
-                if tags:
-                    if any(tag in memory["tags"] for tag in tags):
-                        results.append(memory)
-                        continue
+                score = relevance_weight * match + recency_weight * recency.get(memory_id, 0.0)
+                scored.append((score, match, memory_id))
+            scored.sort(reverse=True)
             
-            # Sort by timestamp (newest first)
-            results.sort(key=lambda x: x["timestamp"], reverse=True)
+            selected = []
+            used = 0
+            for score, match, memory_id in scored:
+                snippet = self._snippet(memory_id, snippet_chars)
+                if used + len(snippet) > max_chars:
+                    continue
+                entry = self._entries[memory_id]
+                selected.append({
+                    "id": memory_id,
+                    "timestamp": entry["timestamp"],
+                    "tags": entry["tags"],
+                    "snippet": snippet,
+                    "relevance": match,
+                    "score": score
+                })
+                used += len(snippet)
             
-            # Limit results
-            return results[:limit]
+            if complete:
+                self._context_cache[cache_key] = (self._generation, selected)
+                if len(self._context_cache) > 64:
+                    self._context_cache = {key: value for key, value in self._context_cache.items()
+                                           if value[0] == self._generation}
+            return selected
         except Exception as e:
-            print(f"Error searching memories: {str(e)}")
+            print(f"Error assembling memory context: {str(e)}")
             return []
     
+    def build_memory_context(self, user_input, max_chars=600, max_tokens=None):
+        """Format the context memories for this user input as a prompt section"""
+        return self.format_memory_context(self.get_context_memories(user_input, max_chars=max_chars,
+                                                                    max_tokens=max_tokens))
+    
+    @staticmethod
+    def format_memory_context(memories):
+        """Format memories from get_context_memories as a prompt section ("" for none)"""
+        if not memories:
+            return ""
+        
+        memory_context = "Here are some things I remember from our previous conversations:\n"
+        for memory in memories:
+            memory_context += f"- {memory['snippet']}\n"
+        return memory_context
+    
     def get_recent_memories(self, limit=5):
         """Get the most recent memories"""
         try:
-            # Load index
-            with open(self.index_file, "r") as f:
-                index = json.load(f)
-            
-            # Sort by timestamp (newest first)
-            sorted_memories = sorted(index["memories"], key=lambda x: x["timestamp"], reverse=True)
-            
-            # Get full memory data for each entry
-            results = []
-            for memory_entry in sorted_memories[:limit]:
-                memory_file = os.path.join(self.memory_dir, f"{memory_entry['id']}.json")
-                if os.path.exists(memory_file):
-                    with open(memory_file, "r") as f:
-                        results.append(json.load(f))
-            
-            return results
+            self._refresh()
+            newest = heapq.nlargest(limit, self._entries.values(), key=lambda x: x["timestamp"])
+            return [self._read(memory_entry) for memory_entry in newest]
         except Exception as e:
             print(f"Error retrieving recent memories: {str(e)}")
             return []
 
+    def delete_memories(self, ids=None, query=None, tags=None):
+        """Delete memories by id, by text query and/or by tag in one atomic log append
+        
+        ``query`` deletes the memories containing it as a phrase (see
+        find_memories), never ranked near-matches. Returns the number of
+        memories deleted. When most of the log is dead records afterwards it
+        is compacted.
+        """
+        try:
+            with self.lock:
+                self._refresh(force=True)
+                to_delete = set(memory_id for memory_id in (ids or []) if memory_id in self._entries)
+                if query:
+                    to_delete.update(self._phrase_matches(query))
+                if tags:
+                    to_delete.update(self.tag_index.ids(self.tag_index.query(any_of=tags)))
+                
+                if not to_delete:
+                    return 0
+                
+                self._append([{"op": "delete", "ids": sorted(to_delete)}])
+                
+                # Memories archived together share their block's record
+                live_bytes = sum({entry["offset"]: entry["length"] for entry in self._entries.values()}.values())
+                if live_bytes < self._log_size / 2:
+                    self.compact()
+                return len(to_delete)
+        except Exception as e:
+            print(f"Error deleting memories: {str(e)}")
+            return 0
+    
+    def clear(self):
+        """Delete every memory and compact the log so nothing is left on disk"""
+        try:
+            with self.lock:
+                self._refresh(force=True)
+                count = len(self._entries)
+                self._append([{"op": "clear"}])
+                self.compact()
+                return count
+        except Exception as e:
+            print(f"Error clearing memories: {str(e)}")
+            return 0
+    
+    def compact(self, archive_moves=None):
+        """Rewrite the log (and vector file) with only live memories
+        
+        Deleted and overwritten records are dropped, so scans, replays and the
+        checkpoint only cost as much as the data that is still alive.
+        Archived memories are written as one small record per archive block;
+        ``archive_moves`` (id -> block location) moves hot memories into
+        blocks that were just appended to the archive.
+        """
+        archive_moves = archive_moves or {}
+        try:
+            with self.lock:
+                self._refresh(force=True)
+                blocks = {}
+                hot = []
+                for entry in sorted(self._entries.values(), key=lambda x: x["offset"]):
+                    location = archive_moves.get(entry["id"]) or entry.get("archive")
+                    if location is None:
+                        hot.append(entry)
+                    else:
+                        blocks.setdefault(tuple(location), []).append(entry)
+                live = [entry for block in blocks.values() for entry in block] + hot
+                
+                header_fields = {}
+                new_vectors = None
+                old_vectors = self.vectors
+                if old_vectors is not None:
+                    header_fields["vectors"] = f"memory_vectors_{uuid.uuid4().hex[:12]}"
+                    new_vectors = VectorIndex(os.path.join(self.memory_dir, header_fields["vectors"]))
+                    rows = [entry["vector_row"] for entry in live if entry.get("vector_row") is not None]
+                    for start in range(0, len(rows), 65536):
+                        new_vectors.append_many(old_vectors.matrix()[rows[start:start + 65536]])
+                
+                new_rows = {}
+                if new_vectors is not None:
+                    for entry in live:
+                        if entry.get("vector_row") is not None:
+                            new_rows[entry["id"]] = len(new_rows)
+                
+                def live_records():
+                    for location, block in blocks.items():
+                        ids = [entry["id"] for entry in block]
+                        yield {"op": "archive_block", "offset": location[0], "length": location[1], "ids": ids,
+                               "vector_rows": [new_rows.get(memory_id) for memory_id in ids]}
+                    for entry in hot:
+                        record = {"op": "put", "memory": self.store.read_at(entry["offset"], entry["length"])["memory"]}
+                        if entry["id"] in new_rows:
+                            record["vector_row"] = new_rows[entry["id"]]
+                        yield record
+                
+                old_size = self._log_size
+                self.store.rewrite(live_records(), header_fields)
+                if not blocks:
+                    # Nothing archived is alive any more (e.g. after clear()), so drop the cold data too
+                    self.archive.reset()
+                
+                if old_vectors is not None:
+                    try:
+                        old_vectors.reset()
+                    except OSError as e:
+                        # Another process may still have the old file mapped (Windows)
+                        print(f"Could not remove old vector file: {str(e)}")
+                self._load_index()
+                self.checkpoint()
+                if self.vectors is not None and self.use_ivf:
+                    self.vectors.build_ivf()
+                
+                print(f"Compacted memory log from {old_size} to {self._log_size} bytes")
+                return True
+        except Exception as e:
+            print(f"Error compacting memory log: {str(e)}")
+            return False
+    
+    def apply_retention(self, max_age_days=None, block_size=256):
+        """Move memories older than ``max_age_days`` into the compressed archive
+        
+        Hot memories stay in the log; cold ones are packed into gzip blocks of
+        ``block_size`` memories and the log is compacted so startup replay and
+        scans only pay for the hot tier. Archived memories keep their index
+        entries, so get_memory and search read them transparently.
+        Returns the number of memories archived.
+        """
+        max_age_days = max_age_days if max_age_days is not None else self.retention_days
+        if max_age_days is None:
+            return 0
+        
+        try:
+            with self.lock:
+                self._refresh(force=True)
+                cutoff = time.time() - max_age_days * 86400
+                cold = sorted((entry for entry in self._entries.values()
+                               if entry.get("archive") is None and entry["timestamp"] < cutoff),
+                              key=lambda x: x["timestamp"])
+                if not cold:
+                    return 0
+                
+                moves = {}
+                for start in range(0, len(cold), block_size):
+                    chunk = cold[start:start + block_size]
+                    location = self.archive.append_block([self._read(entry) for entry in chunk])
+                    for entry in chunk:
+                        moves[entry["id"]] = list(location)
+                
+                if not self.compact(archive_moves=moves):
+                    return 0
+                print(f"Archived {len(cold)} memories older than {max_age_days} days")
+                return len(cold)
+        except Exception as e:
+            print(f"Error archiving old memories: {str(e)}")
+            return 0
+    
+    def rollup_memories(self, summarize, older_than_days=90, min_group=5, keep_tags=("important",)):
+        """Fold groups of old memories into one summary memory each
+        
+        Old memories are grouped by their first tag and every group of at
+        least ``min_group`` is passed to ``summarize`` (a list of texts ->
+        summary text, typically an LLM call). The summary is saved tagged
+        with the group's tag and "rollup", and the originals are deleted in
+        the same log write. Memories carrying one of ``keep_tags`` are never
+        rolled up. Returns the number of memories folded away.
+        """
+        self._refresh()
+        cutoff = time.time() - older_than_days * 86400
+        groups = {}
+        for entry in list(self._entries.values()):
+            if entry["timestamp"] >= cutoff or "rollup" in entry["tags"] or set(entry["tags"]) & set(keep_tags):
+                continue
+            groups.setdefault(entry["tags"][0] if entry["tags"] else None, []).append(entry)
+        
+        rolled = 0
+        for tag, group in groups.items():
+            if len(group) < min_group:
+                continue
+            group.sort(key=lambda x: x["timestamp"])
+            try:
+                # Summarizing can take a while (LLM), so it runs without holding the lock
+                summary = summarize([self._read(entry)["content"] for entry in group])
+                if not summary:
+                    continue
+                
+                memory = self._new_memory(summary, ([tag] if tag else []) + ["rollup"], group[-1]["timestamp"])
+                vectors = self._embed([summary])
+                with self.lock:
+                    self._refresh(force=True)
+                    ids = [entry["id"] for entry in group if entry["id"] in self._entries]
+                    self._append([{"op": "put", "memory": memory}, {"op": "delete", "ids": ids}],
+                                 vectors=vectors + [None] if vectors is not None else None)
+                rolled += len(ids)
+            except Exception as e:
+                print(f"Error rolling up memories tagged {tag}: {str(e)}")
+        return rolled
+    
+    def tag_counts(self):
+        """Number of memories per tag ("what topics do I have"), kept up to date on save and delete"""
+        self._refresh()
+        return dict(self.tag_index.counts)
+    
+    def related_tags(self, tag):
+        """How often each other tag appears on the same memories as ``tag``"""
+        self._refresh()
+        return dict(self.tag_index.cooccurrence.get(tag, {}))
+    
+    def cache_stats(self):
+        """Hit/miss counters for the record cache and how often the index was refreshed"""
+        return {
+            "records": self._records.stats(),
+            "archive_blocks": self._archive_blocks.stats(),
+            "index_refreshes": self._index_refreshes,
+            "index_reloads": self._index_reloads,
+            "generation": self._generation
+        }
+    
+    def close(self):
+        """Checkpoint the index and release the log"""
+        if self._unsaved_appends:
+            self.checkpoint()
+        if self._embed_pool is not None:
+            self._embed_pool.shutdown(wait=False)
+        self.store.close()
+        self.archive.close()
+
+def _stress_worker(memory_dir, worker, saves):
+    manager = MemoryManager(memory_dir)
+    for i in range(saves):
+        manager.save_memory(f"stress worker {worker} save {i}", tags=["stress"])
+    manager.close()
+
+def run_stress_test(processes=4, saves=250, memory_dir=None):
+    """Save from several processes at once and check that every record made it into the log"""
+    import multiprocessing
+    import tempfile
+    
+    memory_dir = memory_dir or tempfile.mkdtemp(prefix="memory_stress_")
+    started = time.time()
+    workers = [multiprocessing.Process(target=_stress_worker, args=(memory_dir, worker, saves))
+               for worker in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    
+    manager = MemoryManager(memory_dir)
+    saved = set(record["memory"]["content"] for offset, length, record in manager.store.scan(manager.store.header_size)
+                if record.get("op") == "put")
+    expected = set(f"stress worker {worker} save {i}" for worker in range(processes) for i in range(saves))
+    lost = expected - saved
+    if len(manager._entries) != len(expected):
+        print(f"Index holds {len(manager._entries)} memories, expected {len(expected)}")
+        lost = lost or {"index"}
+    print(f"{processes} processes x {saves} saves in {time.time() - started:.2f}s: "
+          f"{len(saved)} saved, {len(lost)} lost ({memory_dir})")
+    manager.close()
+    return not lost
+
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Memory manager")
+    parser.add_argument("--stress", action="store_true", help="Run the multi-process save stress test")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--saves", type=int, default=250)
+    args = parser.parse_args()
+    
+    if args.stress:
+        sys.exit(0 if run_stress_test(args.processes, args.saves) else 1)
+    
     # Test the memory manager
     memory_manager = MemoryManager()
     
@@ -162,4 +1041,6 @@ if __name__ == "__main__":
         
         # Get recent memories
         recent = memory_manager.get_recent_memories(limit=3)
-        print(f"Recent memories: {recent}")
\ No newline at end of file
+        print(f"Recent memories: {recent}")
+    
+    memory_manager.close()
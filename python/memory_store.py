@@ -0,0 +1,284 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import threading
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+class FileLock:
+    """Advisory inter-process lock held on a small lock file
+    
+    Re-entrant within a process, and also serializes threads of that process.
+    """
+    
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+    
+    def _lock_file(self):
+        self._file = open(self.path, "a+b")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if os.name == "nt":
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self._file.close()
+                    self._file = None
+                    raise TimeoutError(f"Timed out waiting for lock {self.path}")
+                time.sleep(0.005)
+    
+    def _unlock_file(self):
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+    
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._lock_file()
+            except Exception:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+    
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_file()
+        self._thread_lock.release()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+def replace_file(src, dst, attempts=50):
+    """os.replace, retried while another process briefly holds ``dst`` open (Windows)"""
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.02)
+
+class MemoryLog:
+    """Append-only JSON-lines log that holds every memory record.
+    
+    Each line is one operation. The first line is a header carrying a random
+    ``log_id`` so that derived indexes can tell whether they were built from
+    this exact log. Records are addressed by ``(offset, length)`` so a reader
+    can seek straight to a memory without opening a file per memory.
+    
+    Writers from several processes must hold ``lock``; appends then never
+    interleave and a rewrite is swapped in atomically with os.replace.
+    """
+    
+    def __init__(self, path, lock=None):
+        self.path = path
+        self.lock = lock or FileLock(path + ".lock")
+        self._reader = None
+        
+        with self.lock:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                self._write_header()
+        
+        self._read_header()
+    
+    @staticmethod
+    def _new_header(fields=None):
+        header = {"op": "header", "version": 2, "log_id": uuid.uuid4().hex}
+        header.update(fields or {})
+        return header
+    
+    def _write_header(self):
+        with open(self.path, "wb") as f:
+            f.write(self.encode(self._new_header()))
+    
+    def _read_header(self):
+        with open(self.path, "rb") as f:
+            line = f.readline()
+        self.header_size = len(line)
+        self.header = json.loads(line)
+        self.log_id = self.header.get("log_id")
+    
+    def reopen(self):
+        """Re-read the header after the log file was replaced (e.g. by compaction)"""
+        self.close()
+        self._read_header()
+    
+    @staticmethod
+    def encode(record):
+        """Serialize a record as a single newline-terminated UTF-8 line"""
+        return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    
+    def size(self):
+        return os.path.getsize(self.path)
+    
+    def identity(self):
+        """(inode, device, size) of the log file, used to notice writes by other processes"""
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_dev, stat.st_size
+    
+    def append(self, record):
+        """Append one record and return its (offset, length)"""
+        return self.append_many([record])[0]
+    
+    def append_many(self, records):
+        """Append several records with a single write and return their locations"""
+        lines = [self.encode(record) for record in records]
+        with open(self.path, "a+b") as f:
+            offset = f.seek(0, os.SEEK_END)
+            # A crashed writer can leave a torn last line; start on a fresh one
+            prefix = b""
+            if offset > 0:
+                f.seek(offset - 1)
+                if f.read(1) != b"\n":
+                    prefix = b"\n"
+            f.seek(0, os.SEEK_END)
+            f.write(prefix + b"".join(lines))
+            f.flush()
+        offset += len(prefix)
+        
+        locations = []
+        for line in lines:
+            locations.append((offset, len(line)))
+            offset += len(line)
+        return locations
+    
+    def rewrite(self, records, header_fields=None):
+        """Atomically replace the log with a fresh header followed by ``records``
+        
+        The new log is written next to the old one and swapped in with
+        os.replace, so readers see either the old or the new file, never a mix.
+        Returns the (offset, length) of every record written.
+        """
+        tmp_path = self.path + ".tmp"
+        locations = []
+        with open(tmp_path, "wb") as f:
+            offset = f.write(self.encode(self._new_header(header_fields)))
+            for record in records:
+                line = self.encode(record)
+                f.write(line)
+                locations.append((offset, len(line)))
+                offset += len(line)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self.close()
+        replace_file(tmp_path, self.path)
+        self._read_header()
+        return locations
+    
+    def read_at(self, offset, length):
+        """Read and decode the record stored at the given location"""
+        if os.name == "nt":
+            # A handle kept open would stop another process from replacing the log
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length))
+        
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        self._reader.seek(offset)
+        return json.loads(self._reader.read(length))
+    
+    def scan(self, start=0):
+        """Yield (offset, length, record) for every complete record from ``start``
+        
+        A last line without its newline may still be being written and is not
+        yielded. Complete lines that fail to parse (left by a crashed writer)
+        are skipped.
+        """
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Skipping damaged record at offset {offset} of {self.path}")
+                    record = None
+                if record is not None and record.get("op") != "header":
+                    yield offset, len(line), record
+                offset += len(line)
+    
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+class MemoryArchive:
+    """Append-only file of gzip-compressed blocks of memories (the cold tier)
+    
+    Each block is one gzip member holding a JSON list of memories, addressed
+    by ``(offset, length)`` like log records. Blocks are never rewritten; the
+    log says which memories of a block are still alive.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._reader = None
+    
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+    
+    def append_block(self, memories):
+        """Compress ``memories`` into a new block and return its (offset, length)"""
+        data = gzip.compress(json.dumps(memories, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with open(self.path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset, len(data)
+    
+    def read_block(self, offset, length):
+        """Decompress one block and return its memories keyed by id"""
+        if os.name == "nt":
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+        else:
+            if self._reader is None:
+                self._reader = open(self.path, "rb")
+            self._reader.seek(offset)
+            data = self._reader.read(length)
+        return {memory["id"]: memory for memory in json.loads(gzip.decompress(data))}
+    
+    def reset(self):
+        """Delete the archive once no block in it is referenced any more"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
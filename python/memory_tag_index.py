@@ -0,0 +1,104 @@
+class TagIndex:
+    """Tag -> bitset of document numbers, with precomputed tag and co-occurrence counts
+    
+    Bitsets are plain Python ints (bit ``doc`` set when that document has the
+    tag), so AND/OR/NOT filters are single big-int operations. Document
+    numbers are small dense integers handed out by the owner.
+    
+    Setting one bit in a big int copies the whole int, so added documents are
+    queued per tag and folded into the bitsets in one pass when next needed.
+    """
+    
+    def __init__(self):
+        self.bitmaps = {}
+        self.live = 0
+        self._pending = {}
+        self.doc_ids = []
+        self.counts = {}
+        self.cooccurrence = {}
+    
+    def add(self, doc, memory_id, tags):
+        if doc >= len(self.doc_ids):
+            self.doc_ids.extend([None] * (doc + 1 - len(self.doc_ids)))
+        self.doc_ids[doc] = memory_id
+        
+        tags = set(tags)
+        # The key None queues the document for the live bitset
+        self._pending.setdefault(None, []).append(doc)
+        for tag in tags:
+            self._pending.setdefault(tag, []).append(doc)
+            self.counts[tag] = self.counts.get(tag, 0) + 1
+            pairs = self.cooccurrence.setdefault(tag, {})
+            for other in tags:
+                if other != tag:
+                    pairs[other] = pairs.get(other, 0) + 1
+    
+    def _flush(self):
+        """Fold queued documents into their bitsets"""
+        for tag, docs in self._pending.items():
+            bitmap = self.live if tag is None else self.bitmaps.get(tag, 0)
+            size = max(bitmap.bit_length(), max(docs) + 1) // 8 + 1
+            data = bytearray(bitmap.to_bytes(size, "little"))
+            for doc in docs:
+                data[doc >> 3] |= 1 << (doc & 7)
+            bitmap = int.from_bytes(data, "little")
+            if tag is None:
+                self.live = bitmap
+            else:
+                self.bitmaps[tag] = bitmap
+        self._pending = {}
+    
+    def remove(self, doc, tags):
+        if doc >= len(self.doc_ids) or self.doc_ids[doc] is None:
+            return
+        self.doc_ids[doc] = None
+        self._flush()
+        
+        tags = set(tags)
+        mask = ~(1 << doc)
+        self.live &= mask
+        for tag in tags:
+            if tag not in self.bitmaps:
+                continue
+            self.bitmaps[tag] &= mask
+            self.counts[tag] -= 1
+            pairs = self.cooccurrence.get(tag, {})
+            for other in tags:
+                if other != tag and other in pairs:
+                    pairs[other] -= 1
+                    if pairs[other] == 0:
+                        del pairs[other]
+            if self.counts[tag] == 0:
+                del self.bitmaps[tag]
+                del self.counts[tag]
+                self.cooccurrence.pop(tag, None)
+    
+    def query(self, any_of=None, all_of=None, none_of=None):
+        """Bitset of documents with any of ``any_of``, all of ``all_of`` and none of ``none_of``"""
+        self._flush()
+        result = None
+        if any_of:
+            result = 0
+            for tag in any_of:
+                result |= self.bitmaps.get(tag, 0)
+        for tag in all_of or []:
+            bitmap = self.bitmaps.get(tag, 0)
+            result = bitmap if result is None else result & bitmap
+        if result is None:
+            # Only exclusions (or nothing) given: start from every live document
+            result = self.live
+        for tag in none_of or []:
+            result &= ~self.bitmaps.get(tag, 0)
+        return result
+    
+    def ids(self, bitmap):
+        """Memory ids for the documents set in ``bitmap``, lowest document first"""
+        bits = bin(bitmap)[:1:-1]
+        ids = []
+        doc = bits.find("1")
+        while doc != -1:
+            memory_id = self.doc_ids[doc] if doc < len(self.doc_ids) else None
+            if memory_id is not None:
+                ids.append(memory_id)
+            doc = bits.find("1", doc + 1)
+        return ids
@@ -0,0 +1,126 @@
+import re
+import math
+import heapq
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Words that appear in almost every memory and carry no meaning for recall
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "that", "the", "this", "to", "was", "with", "you"
+}
+
+def tokenize(text):
+    """Split text into lowercase word tokens, dropping stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class TextIndex:
+    """Inverted index (token -> {memory id: term frequency}) ranked with BM25"""
+    
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+    
+    def add(self, doc_id, text):
+        """Index a document; re-adding an id replaces its previous text"""
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        
+        tokens = tokenize(text)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        
+        for token, count in counts.items():
+            self.postings.setdefault(token, {})[doc_id] = count
+        
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+    
+    def remove(self, doc_id, text=None):
+        """Drop a document from the posting lists
+        
+        Passing the document's text limits the work to its own tokens;
+        without it every posting list is checked.
+        """
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        
+        self.total_length -= length
+        tokens = set(tokenize(text)) if text is not None else list(self.postings)
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[token]
+    
+    def search(self, query, limit=5, allowed=None):
+        """Return up to ``limit`` (memory id, score) pairs, best match first
+        
+        ``allowed`` optionally restricts results to a set of memory ids.
+        """
+        doc_count = len(self.doc_lengths)
+        if doc_count == 0:
+            return []
+        
+        terms = [term for term in set(tokenize(query)) if term in self.postings]
+        if not terms:
+            return []
+        
+        # Terms found in most memories add little but cost a full posting-list walk;
+        # skip them as long as a more selective term is present
+        terms.sort(key=lambda term: len(self.postings[term]))
+        selective = [term for term in terms if len(self.postings[term]) <= doc_count // 2]
+        if selective:
+            terms = selective
+        
+        average_length = self.total_length / doc_count or 1.0
+        scores = {}
+        for term in terms:
+            posting = self.postings[term]
+            df = len(posting)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, tf in posting.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+    
+    def match_all(self, query):
+        """Ids of the documents containing every token of ``query``
+        
+        Returns None when the query has no indexed-word tokens (only
+        stopwords), as the index cannot narrow such a query down.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        if any(term not in self.postings for term in terms):
+            return set()
+        
+        terms = sorted(terms, key=lambda term: len(self.postings[term]))
+        matched = set(self.postings[terms[0]])
+        for term in terms[1:]:
+            matched.intersection_update(self.postings[term])
+            if not matched:
+                break
+        return matched
+    
+    def to_dict(self):
+        return {"postings": self.postings, "doc_lengths": self.doc_lengths}
+    
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index
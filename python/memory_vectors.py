@@ -0,0 +1,295 @@
+import os
+import json
+import hashlib
+
+from memory_text_index import tokenize
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+class HashingEmbedder:
+    """Deterministic local embedder based on feature hashing
+    
+    Words and adjacent word pairs are hashed into a fixed number of signed
+    buckets. It needs no model server, gives the same vector for the same
+    text on every machine, and is what tests and offline runs should use.
+    """
+    
+    def __init__(self, dim=512):
+        self.dim = dim
+    
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if (value >> 63) & 1 else -1.0
+    
+    def embed(self, text):
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = [0.0] * self.dim
+        for feature in features:
+            index, sign = self._bucket(feature)
+            vector[index] += sign
+        return vector
+
+class OllamaEmbedder:
+    """Embedder backed by the Ollama embeddings endpoint
+    
+    When the server is unreachable or does not have the model (404) the
+    embedder turns itself off and embed() returns None from then on, so
+    callers fall back to text search instead of failing on every call.
+    """
+    
+    def __init__(self, model="nomic-embed-text", api_url="http://localhost:11434/api", timeout=30,
+                 connect_timeout=3.05):
+        self.model = model
+        self.api_url = api_url
+        self.timeout = (connect_timeout, timeout)
+        self.available = True
+        self._session = None
+    
+    def _disable(self, reason):
+        self.available = False
+        print(f"Semantic memory recall disabled: {reason}")
+    
+    def probe(self):
+        """Check once that the server has the model; returns (and remembers) whether it can embed"""
+        import requests
+        
+        try:
+            response = requests.post(f"{self.api_url}/show", json={"model": self.model}, timeout=self.timeout)
+            if response.status_code == 404:
+                self._disable(f"model {self.model} is not available (try: ollama pull {self.model})")
+            elif response.status_code != 200:
+                self._disable(f"{response.status_code} - {response.text}")
+        except requests.ConnectionError as e:
+            self._disable(f"cannot reach Ollama ({str(e)})")
+        except Exception as e:
+            print(f"Error checking embedding model: {str(e)}")
+        return self.available
+    
+    def embed(self, text):
+        import requests
+        
+        if not self.available:
+            return None
+        # Every saved memory is embedded, so keep the connection alive between calls
+        if self._session is None:
+            self._session = requests.Session()
+        try:
+            response = self._session.post(f"{self.api_url}/embeddings",
+                                          json={"model": self.model, "prompt": text},
+                                          timeout=self.timeout)
+            if response.status_code == 200:
+                return response.json().get("embedding") or None
+            if response.status_code == 404:
+                self._disable(f"model {self.model} is not available (try: ollama pull {self.model})")
+            else:
+                print(f"Error from Ollama embeddings API: {response.status_code} - {response.text}")
+        except requests.ConnectionError as e:
+            self._disable(f"cannot reach Ollama ({str(e)})")
+        except Exception as e:
+            print(f"Error getting embedding from Ollama: {str(e)}")
+        return None
+
+class VectorIndex:
+    """Unit-normalised float32 vectors stored as one contiguous, memory-mapped matrix
+    
+    Row ``i`` of ``<base>.f32`` is the i-th vector ever appended. The owner
+    maps rows to memory ids with register()/invalidate(); rows that are not
+    registered (replaced or deleted memories) never show up in results.
+    
+    With ``use_ivf`` the rows are additionally grouped around k-means
+    centroids and a search only scores the ``nprobe`` closest groups.
+    """
+    
+    def __init__(self, base_path, use_ivf=False, nprobe=8):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required for semantic memory search")
+        
+        self.data_file = base_path + ".f32"
+        self.meta_file = base_path + ".json"
+        self.ivf_file = base_path + ".ivf.npz"
+        self.use_ivf = use_ivf
+        self.nprobe = nprobe
+        
+        self.dim = None
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, "r") as f:
+                self.dim = json.load(f).get("dim")
+        
+        self._matrix = None
+        self._valid = np.zeros(0, dtype=bool)
+        self.row_ids = {}
+        
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = None
+        if self.use_ivf and os.path.exists(self.ivf_file):
+            self._load_ivf()
+    
+    def __len__(self):
+        if self.dim is None or not os.path.exists(self.data_file):
+            return 0
+        return os.path.getsize(self.data_file) // (self.dim * 4)
+    
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def matrix(self):
+        """Memory-mapped (rows, dim) view of every stored vector"""
+        rows = len(self)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            if rows == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._matrix = np.memmap(self.data_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+    
+    def append_many(self, vectors):
+        """Append vectors and return their row numbers"""
+        vectors = [self._normalize(vector) for vector in vectors]
+        if not vectors:
+            return []
+        
+        if self.dim is None:
+            self.dim = int(vectors[0].shape[0])
+            with open(self.meta_file, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        
+        for vector in vectors:
+            if vector.shape[0] != self.dim:
+                raise ValueError(f"Embedding has {vector.shape[0]} dimensions, index expects {self.dim}")
+        
+        first_row = len(self)
+        with open(self.data_file, "ab") as f:
+            f.write(np.stack(vectors).astype(np.float32).tobytes())
+        return list(range(first_row, first_row + len(vectors)))
+    
+    def _grow(self, rows):
+        if rows > self._valid.shape[0]:
+            grown = np.zeros(max(rows, 2 * self._valid.shape[0], 1024), dtype=bool)
+            grown[:self._valid.shape[0]] = self._valid
+            self._valid = grown
+    
+    def register(self, row, memory_id):
+        """Make ``row`` searchable as ``memory_id``"""
+        self._grow(row + 1)
+        self._valid[row] = True
+        self.row_ids[row] = memory_id
+    
+    def invalidate(self, row):
+        if row is not None and row < self._valid.shape[0]:
+            self._valid[row] = False
+            self.row_ids.pop(row, None)
+    
+    def search(self, vector, k=5):
+        """Return up to ``k`` (memory id, cosine similarity) pairs, best first"""
+        matrix = self.matrix()
+        if matrix.shape[0] == 0 or not self.row_ids:
+            return []
+        query = self._normalize(vector)
+        if query.shape[0] != self.dim:
+            return []
+        
+        self._grow(matrix.shape[0])
+        rows = self._candidate_rows(query, matrix.shape[0])
+        if rows is None:
+            scores = np.where(self._valid[:matrix.shape[0]], matrix @ query, -np.inf)
+            rows = np.arange(matrix.shape[0])
+        else:
+            rows = rows[self._valid[rows]] if rows.size else rows
+            scores = matrix[rows] @ query if rows.size else np.zeros(0, dtype=np.float32)
+        
+        if scores.shape[0] == 0:
+            return []
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.row_ids[int(rows[i])], float(scores[i])) for i in top
+                if np.isfinite(scores[i]) and int(rows[i]) in self.row_ids]
+    
+    def build_ivf(self, n_lists=None, iterations=10, sample_size=50000):
+        """Cluster the stored vectors with k-means so searches only probe nearby groups"""
+        matrix = self.matrix()
+        rows = matrix.shape[0]
+        if rows == 0:
+            return False
+        
+        rng = np.random.default_rng(0)
+        sample = matrix[np.sort(rng.choice(rows, size=min(sample_size, rows), replace=False))]
+        n_lists = min(n_lists or max(1, int(np.sqrt(rows))), sample.shape[0])
+        
+        # Spherical k-means on a sample: centroids stay unit length so scoring is a dot product
+        centroids = sample[rng.choice(sample.shape[0], size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            moved = norms > 0
+            centroids[moved] = sums[moved] / norms[moved, None]
+        
+        self._centroids = centroids.astype(np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = None
+        self.use_ivf = True
+        self._assign_new_rows(rows)
+        np.savez(self.ivf_file, centroids=self._centroids, assignments=self._assignments)
+        return True
+    
+    def _load_ivf(self):
+        try:
+            data = np.load(self.ivf_file)
+            self._centroids = data["centroids"]
+            self._assignments = data["assignments"]
+            self._lists = None
+        except Exception as e:
+            print(f"Error loading vector clusters, falling back to exact search: {str(e)}")
+            self._centroids = None
+    
+    def _assign_new_rows(self, rows, batch=65536):
+        """Assign rows appended since the last clustering to their nearest centroid"""
+        start = self._assignments.shape[0]
+        if start >= rows:
+            return
+        
+        matrix = self.matrix()
+        labels = [self._assignments]
+        for begin in range(start, rows, batch):
+            block = np.asarray(matrix[begin:min(rows, begin + batch)])
+            labels.append(np.argmax(block @ self._centroids.T, axis=1).astype(np.int32))
+        self._assignments = np.concatenate(labels)
+        self._lists = None
+    
+    def _candidate_rows(self, query, rows):
+        """Rows in the ``nprobe`` closest clusters, or None for an exact scan"""
+        if not self.use_ivf or self._centroids is None:
+            return None
+        
+        self._assign_new_rows(rows)
+        if self._lists is None:
+            order = np.argsort(self._assignments, kind="stable")
+            bounds = np.searchsorted(self._assignments[order], np.arange(self._centroids.shape[0] + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(self._centroids.shape[0])]
+        
+        nprobe = min(self.nprobe, self._centroids.shape[0])
+        probes = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self._lists[c] for c in probes]))
+    
+    def reset(self):
+        """Drop every stored vector (e.g. after switching to an embedder of another size)"""
+        self._matrix = None
+        for path in (self.data_file, self.meta_file, self.ivf_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dim = None
+        self._valid = np.zeros(0, dtype=bool)
+        self.row_ids = {}
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = None
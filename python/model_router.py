@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import time
+import threading
+
+# Cheap intent cues, checked against the lowercased user input
+GREETING = re.compile(r"^(hi|hello|hey|yo|good (morning|afternoon|evening|night)|thanks|thank you|bye|goodbye)\b")
+SMALL_TALK = re.compile(r"\b(how are you|what's up|whats up|how's it going|how is it going|what are you doing)\b")
+THINK_HARDER = re.compile(r"\b(think (harder|carefully|it through)|in detail|step by step|explain|why|analy[sz]e|"
+                          r"compare|plan|pros and cons|write (a|an|me)|code|debug|calculate)\b")
+
+# Signs that the small model's answer should not be trusted
+UNSURE = ("i'm not sure", "i am not sure", "i don't know", "i do not know", "not certain", "i can't",
+          "i cannot", "could you clarify", "as an ai", "language model")
+
+class ModelRouter:
+    """Pick a small or a large model per turn from cheap features of the input
+    
+    Greetings, small talk and short inputs go to the small model; explicit
+    "think harder" cues, long inputs and turns with memories that match the
+    input (relevance of at least ``memory_relevance``) go to the large one.
+    In ``hedged`` mode a turn routed to the small model is answered by it in
+    full first and escalated to the large model when the answer looks
+    unsure. Without a small model everything goes to the large one.
+    
+    Every decision is appended (with its latency) to ``log_path`` as a JSON
+    line so the thresholds can be tuned from real turns. ``deadline`` bounds
+    every model call of a turn and ``hedge_after`` hedges them (see
+    OllamaInterface); other users of the same interfaces are not hedged.
+    """
+    
+    def __init__(self, large, small=None, hedged=False, short_words=8, long_words=30, log_path=None, deadline=None,
+                 memory_relevance=0.5, hedge_after=None):
+        self.large = large
+        self.small = small
+        self.hedged = hedged
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.short_words = short_words
+        self.long_words = long_words
+        self.memory_relevance = memory_relevance
+        if log_path is None:
+            log_path = os.path.join(os.path.expanduser("~"), "HumanAI", "routing_log.jsonl")
+        self.log_path = log_path
+        self.last_decision = None
+        self._log_lock = threading.Lock()
+    
+    def features(self, user_input, memories=()):
+        """Routing features; ``memories`` are the turn's context memories (see MemoryManager.get_context_memories)"""
+        text = user_input.lower().strip()
+        if GREETING.search(text):
+            intent = "greeting"
+        elif SMALL_TALK.search(text):
+            intent = "small_talk"
+        elif THINK_HARDER.search(text):
+            intent = "think_harder"
+        elif text.endswith("?"):
+            intent = "question"
+        else:
+            intent = "statement"
+        return {
+            "words": len(text.split()),
+            "intent": intent,
+            "memories": sum(1 for memory in memories if memory.get("relevance", 0) >= self.memory_relevance)
+        }
+    
+    def route(self, features):
+        """Return (interface, reason) for a turn with the given features"""
+        if self.small is None:
+            return self.large, "single_model"
+        if features["intent"] == "think_harder":
+            return self.large, "think_harder"
+        if features["words"] > self.long_words:
+            return self.large, "long_input"
+        if features["intent"] in ("greeting", "small_talk") and features["words"] <= self.short_words:
+            return self.small, features["intent"]
+        if features["memories"]:
+            return self.large, "memories"
+        if features["words"] <= self.short_words:
+            return self.small, "short_input"
+        return self.large, "default"
+    
+    @staticmethod
+    def confident(reply):
+        """Heuristic: is this small-model reply good enough to keep?"""
+        text = reply.strip().lower()
+        if not text or text.startswith("error:") or len(text.split()) < 2:
+            return False
+        return not any(phrase in text for phrase in UNSURE)
+    
+    def respond(self, chat_session, content, system_prompt=None, user_input=None, memories=()):
+        """Yield the reply to ``content`` from the routed model (see ChatSession.stream)
+        
+        ``user_input`` (the raw utterance, defaults to ``content``) and
+        ``memories`` are only used for the routing features.
+        """
+        features = self.features(user_input if user_input is not None else content, memories)
+        ollama, reason = self.route(features)
+        decision = dict(features, model=ollama.model, reason=reason, escalated=False)
+        self.last_decision = dict(decision, ollama=ollama)
+        messages = chat_session.prepare(content, system_prompt)
+        options = chat_session.options()
+        started = time.monotonic()
+        
+        try:
+            if ollama is self.small and self.hedged:
+                reply = ollama.chat(messages, options, caller=chat_session.caller, deadline=self.deadline,
+                                    hedge_after=self.hedge_after)
+                decision["small_ms"] = (time.monotonic() - started) * 1000
+                if self.confident(reply):
+                    yield reply
+                    return
+                
+                # Low confidence: answer again with the large model
+                decision.update(escalated=True, model=self.large.model)
+                self.last_decision = dict(decision, ollama=self.large)
+                self.large.metrics.count(chat_session.caller, self.large.model, "escalations")
+                ollama = self.large
+            
+            yield from ollama.chat_stream(messages, options, caller=chat_session.caller, deadline=self.deadline,
+                                          hedge_after=self.hedge_after)
+        finally:
+            decision["latency_ms"] = (time.monotonic() - started) * 1000
+            stats = ollama.last_stats or {}
+            decision["first_token_ms"] = stats.get("first_token_ms")
+            decision["fallback"] = ollama.last_fallback
+            self.last_decision["fallback"] = ollama.last_fallback
+            self._log(decision)
+    
+    def _log(self, decision):
+        print(f"Routed to {decision['model']} ({decision['reason']}"
+              f"{', escalated' if decision['escalated'] else ''}) in {decision['latency_ms']:.0f} ms")
+        try:
+            directory = os.path.dirname(self.log_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with self._log_lock:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(dict(decision, timestamp=time.time())) + "\n")
+        except Exception as e:
+            print(f"Error writing routing log: {str(e)}")
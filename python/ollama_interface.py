@@ -1,32 +1,521 @@
 import json
 import sys
+import time
+import random
+import hashlib
+import threading
+import socketserver
+import concurrent.futures
 import requests
-from text_to_speech_win import TextToSpeech  # Import the TTS class
+from requests.adapters import HTTPAdapter
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+from endpoint_pool import EndpointPool
+from fallback_answers import FallbackAnswers
+from llm_metrics import default_registry
+
+# Worth retrying: the server is busy or a proxy in front of it is
+RETRY_STATUSES = {429, 502, 503, 504}
+
+class DeadlineExceeded(TimeoutError):
+    """No answer (or, for a stream, no first token) before the call's deadline"""
+
+def _in_thread(fn):
+    """Run fn() on a daemon thread; returns a Future for its result"""
+    future = concurrent.futures.Future()
+    
+    def run():
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+    
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+def _init_com():
+    """Make the calling thread usable for the SAPI voice (Windows COM); a no-op elsewhere"""
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoInitialize()
+
+def _resume(first, chunks):
+    """A prefetched first chunk followed by the rest of ``chunks`` (closed with this generator)"""
+    try:
+        yield first
+        yield from chunks
+    finally:
+        chunks.close()
 
 class OllamaInterface:
-    def __init__(self, model="mistral", api_url="http://localhost:11434/api"):
+    def __init__(self, model="mistral", api_url="http://localhost:11434/api", connect_timeout=3.05,
+                 read_timeout=300, max_retries=2, backoff=0.25, max_backoff=4.0, pool_size=4, cache=True,
+                 keep_alive="30m", tts=None, metrics=None, caller="default", single_flight=True, deadline=None,
+                 hedge_after=None, hedge=None, fallback=None):
         self.model = model
+        # Several hosts (a list of URLs or a shared EndpointPool) are load balanced, see endpoint_pool.py
+        self._owns_endpoints = isinstance(api_url, (list, tuple))
+        if self._owns_endpoints:
+            api_url = EndpointPool(api_url)
+        if isinstance(api_url, EndpointPool):
+            self.endpoints = api_url
+            self.endpoints.start_probes()
+            api_url = ",".join(endpoint.url for endpoint in self.endpoints.endpoints)
+        else:
+            self.endpoints = None
         self.api_url = api_url
-        self.tts = TextToSpeech()  # Create a TTS instance
+        # Only needed for speak_response; pass one in or it is created on first use
+        self._tts = tts
+        
+        # One pooled keep-alive session instead of a new TCP connection per call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        
+        # cache=True uses the default on-disk response cache; pass a ResponseCache or False/None
+        if cache is True:
+            cache = ResponseCache()
+        self.cache = cache or None
+        
+        # How long the server keeps the model loaded after a call, so turns don't pay the load again
+        self.keep_alive = keep_alive
+        # Server-side timings of the last completed call (see _record_stats), also added to
+        # the metrics registry under the call's caller name (e.g. "conversation", "summarize")
+        self.last_stats = None
+        # Whether the last call was answered from ``fallback`` because it missed its deadline
+        self.last_fallback = False
+        self.metrics = metrics or default_registry
+        self.caller = caller
+        
+        # Identical calls that are in flight at the same time share one upstream request;
+        # pass a SingleFlight to share it between interfaces, or False to turn it off
+        if single_flight is True:
+            single_flight = SingleFlight()
+        self.flights = single_flight or None
+        
+        # Latency bounds (see _race), in seconds: once ``hedge_after`` passes ("p95" uses this
+        # caller's 95th percentile latency) the call is also sent to ``hedge`` (e.g. a smaller
+        # model) or to another endpoint and the first answer wins; once ``deadline`` passes
+        # the call is answered from ``fallback`` instead. Streams are bounded to their first token.
+        # Both can also be given per call, e.g. to hedge only the calls a quick answer matters for.
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.hedge = hedge
+        self.fallback = fallback or FallbackAnswers()
+    
+    @property
+    def tts(self):
+        """Text-to-speech engine, created on first use so headless callers never touch audio"""
+        if self._tts is None:
+            from text_to_speech_win import TextToSpeech
+            self._tts = TextToSpeech()
+        return self._tts
+    
+    def _request(self, method, path, tried=None, **kwargs):
+        """Send a request on the pooled session, retrying connection failures and busy responses
+        
+        Retries wait a random time of up to backoff * 2**attempt ("full jitter") so
+        that several clients do not retry in lockstep. Read timeouts are not
+        retried: the model may simply be slow and a retry would start over.
+        
+        With several endpoints each attempt goes to the one the pool picks,
+        avoiding hosts in ``tried``, to which every host used is added. A
+        streamed response holds on to its endpoint until _release() is
+        called for it.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        tried = [] if tried is None else tried
+        while True:
+            endpoint = None
+            api_url = self.api_url
+            if self.endpoints is not None:
+                endpoint = self.endpoints.choose(self.model, tried)
+                tried.append(endpoint)
+                api_url = endpoint.url
+            
+            try:
+                response = self.session.request(method, f"{api_url}{path}", **kwargs)
+            except (requests.ConnectionError, requests.ConnectTimeout):
+                if endpoint is not None:
+                    self.endpoints.finish(endpoint, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+            except Exception:
+                if endpoint is not None:
+                    self.endpoints.finish(endpoint, ok=False)
+                raise
+            else:
+                if endpoint is not None:
+                    # Calls that got an answer mark the model as loaded there (model affinity)
+                    served = self.model if path in ("/generate", "/chat") and response.status_code == 200 else None
+                    response.endpoint = (endpoint, response.elapsed.total_seconds() * 1000, served)
+                    if not kwargs.get("stream"):
+                        self._release(response)
+                # A host without the model answers 404; another one may have it
+                missing = endpoint is not None and response.status_code == 404 and \
+                    path in ("/generate", "/chat") and len(tried) < len(self.endpoints.endpoints)
+                if missing:
+                    self.endpoints.lacks(endpoint, self.model)
+                elif response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.close()
+                self._release(response)
+                if missing:
+                    continue
+            time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+            attempt += 1
+    
+    def _release(self, response):
+        """Hand a response's endpoint back to the pool (once; a no-op without a pool)"""
+        reserved = getattr(response, "endpoint", None)
+        if reserved is not None:
+            response.endpoint = None
+            endpoint, latency_ms, model = reserved
+            self.endpoints.finish(endpoint, latency_ms, model)
+    
+    def endpoint_stats(self):
+        return self.endpoints.stats() if self.endpoints is not None else None
+    
+    def close(self):
+        self.session.close()
+        if self._owns_endpoints:
+            self.endpoints.close()
+        if self.cache is not None:
+            self.cache.close()
+    
+    def _cache_key(self, prompt, system_prompt, options, use_cache):
+        """Response cache key for a call, or None when the call must go to the model
+        
+        With ``use_cache`` None only deterministic calls (temperature 0) are
+        cached; True caches regardless and False bypasses the cache.
+        """
+        if self.cache is None or use_cache is False:
+            return None
+        if use_cache is None and (options or {}).get("temperature") != 0:
+            return None
+        return ResponseCache.make_key(self.model, system_prompt, prompt, options)
+    
+    def _flight_key(self, path, payload):
+        material = json.dumps([self.api_url, path, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+    
+    def _call(self, path, payload, tried=None):
+        """One non-streaming call: (status code, decoded JSON for a 200 response or the error text)"""
+        response = self._request("POST", path, tried, json=payload)
+        if response.status_code == 200:
+            return response.status_code, response.json()
+        return response.status_code, response.text
+    
+    def _post(self, path, payload, caller=None, deadline=None, hedge_after=None):
+        """Send a non-streaming call within its latency bounds and return (status code, result, shared)
+        
+        ``result`` is the decoded JSON for a 200 response and the error text
+        otherwise. ``shared`` is True when the result came from another call
+        (an identical one already in flight, see SingleFlight, or a hedge)
+        that accounts for it; only the caller that made the request should
+        record its stats or cache it. Raises DeadlineExceeded.
+        """
+        tried = []
+        
+        def primary():
+            if self.flights is None:
+                return self._call(path, payload, tried) + (False,)
+            (status, result), shared = self.flights.do(self._flight_key(path, payload),
+                                                       lambda: self._call(path, payload, tried))
+            if shared:
+                self._count(caller, "coalesced")
+            return status, result, shared
+        
+        target = self._hedge_target()
+        
+        def hedge():
+            status, result = target._call(path, dict(payload, model=target.model), list(tried))
+            if status == 200:
+                target._record_stats(result, caller=caller)
+            return status, result, True
+        
+        return self._race(primary, hedge if target is not None else None, lambda result: result[0] == 200, None,
+                          caller, deadline, "total_ms", hedge_after)
+    
+    def _shared_chunks(self, path, payload, caller=None, deadline=None, hedge_after=None):
+        """Like _stream_chunks, but joined by identical streams started while it runs and bounded by a deadline
+        
+        Returns (chunks, shared); the chunks must be closed when done.
+        Raises DeadlineExceeded when no first chunk arrives in time.
+        """
+        tried = []
+        
+        def primary():
+            if self.flights is None:
+                return self._prefetch(self._stream_chunks(path, payload, caller, tried)) + (False,)
+            chunks, shared = self.flights.stream(self._flight_key(path, payload),
+                                                 lambda: self._stream_chunks(path, payload, caller, tried))
+            if shared:
+                self._count(caller, "coalesced")
+            return self._prefetch(chunks) + (shared,)
+        
+        target = self._hedge_target()
+        
+        def hedge():
+            chunks = target._stream_chunks(path, dict(payload, model=target.model), caller, list(tried))
+            return self._prefetch(chunks) + (True,)
+        
+        first, chunks, shared = self._race(primary, hedge if target is not None else None, lambda result: True,
+                                           lambda result: result[1].close(), caller, deadline, "first_token_ms",
+                                           hedge_after)
+        return (chunks if first is None else _resume(first, chunks)), shared
     
-    def generate_response(self, prompt, system_prompt=None, speak_response=False):
+    @staticmethod
+    def _prefetch(chunks):
+        """Wait for a stream's first chunk; returns (first chunk or None if it is empty, chunks)"""
         try:
-            url = f"{self.api_url}/generate"
+            return next(chunks), chunks
+        except StopIteration:
+            return None, chunks
+        except BaseException:
+            chunks.close()
+            raise
+    
+    def _hedge_target(self):
+        """Where a hedged duplicate goes: the ``hedge`` interface, or this one when there are other endpoints"""
+        if self.hedge is not None:
+            return self.hedge
+        if self.endpoints is not None and len(self.endpoints.endpoints) > 1:
+            return self
+        return None
+    
+    def _hedge_delay(self, caller, metric, deadline, hedge_after=None):
+        hedge_after = self.hedge_after if hedge_after is None else hedge_after
+        if hedge_after != "p95":
+            return hedge_after
+        p95 = self.metrics.percentile(caller or self.caller, self.model, metric, 0.95, min_count=20)
+        if p95 is not None:
+            return p95 / 1000
+        # Not enough history yet
+        return deadline / 2 if deadline is not None else None
+    
+    def _race(self, primary, hedge, good, discard, caller, deadline, metric, hedge_after=None):
+        """Return the result of primary() within the call's latency bounds
+        
+        Once ``hedge_after`` passes without a ``good(result)``, or primary()
+        fails early, hedge() is started too and the first good result wins;
+        ``discard(result)`` is called for results that arrive too late. When
+        the deadline passes first, raises DeadlineExceeded. When neither
+        succeeds, returns the last result or raises the last exception.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        delay = self._hedge_delay(caller, metric, deadline, hedge_after) if hedge is not None else None
+        if deadline is None and delay is None:
+            return primary()
+        
+        started = time.monotonic()
+        running = {_in_thread(primary): False}
+        hedged = False
+        outcome = None
+        
+        def abandon():
+            for future in running:
+                if discard is not None:
+                    future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+        
+        while True:
+            elapsed = time.monotonic() - started
+            waits = [limit - elapsed for limit in (deadline, None if hedged else delay) if limit is not None]
+            done, _ = concurrent.futures.wait(list(running), max(0, min(waits)) if waits else None,
+                                              concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                is_hedge = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    outcome = e
+                    continue
+                if good(result):
+                    if is_hedge:
+                        self._count(caller, "hedge_wins")
+                    abandon()
+                    return result
+                outcome = result
+            
+            elapsed = time.monotonic() - started
+            if deadline is not None and elapsed >= deadline:
+                self._count(caller, "deadline_hits")
+                abandon()
+                raise DeadlineExceeded(f"No answer from {self.model} within {deadline:g}s")
+            if not hedged and delay is not None and (elapsed >= delay or not running):
+                hedged = True
+                self._count(caller, "hedges")
+                running[_in_thread(hedge)] = True
+            if not running:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+    
+    def _fallback(self, question, caller=None):
+        """Answer for a call that missed its deadline (see FallbackAnswers)"""
+        self.last_fallback = True
+        text, source = self.fallback.answer(question)
+        print(f"{self.model} missed its deadline; answering with a {source} fallback")
+        self._count(caller, f"fallback_{source}")
+        return text
+    
+    @staticmethod
+    def _question(messages):
+        """The last user message of a chat, which is what a fallback answer is looked up by"""
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                return message.get("content", "")
+        return ""
+    
+    def warmup(self, background=True, options=None):
+        """Load the model on the server ahead of the first real call
+        
+        A generate request without a prompt makes Ollama load the model (and
+        keep it for ``keep_alive``) without generating anything. Returns a
+        concurrent.futures.Future that resolves to True once the model is
+        ready, or False if loading failed; with ``background`` the request
+        runs on a daemon thread so the caller can keep initializing. Pass
+        the ``options`` (e.g. num_ctx) the real calls will use, or the
+        server loads the model again for them.
+        """
+        future = concurrent.futures.Future()
+        
+        def load():
+            started = time.monotonic()
+            payload = {"model": self.model, "keep_alive": self.keep_alive}
+            if options:
+                payload["options"] = options
+            try:
+                response = self._request("POST", "/generate", json=payload)
+                if response.status_code == 200:
+                    print(f"Model {self.model} ready after {time.monotonic() - started:.1f}s")
+                    future.set_result(True)
+                else:
+                    print(f"Error warming up model {self.model}: {response.status_code} - {response.text}")
+                    future.set_result(False)
+            except Exception as e:
+                print(f"Error warming up model {self.model}: {str(e)}")
+                future.set_result(False)
+        
+        if background:
+            thread = threading.Thread(target=load)
+            thread.daemon = True
+            thread.start()
+        else:
+            load()
+        return future
+    
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+    
+    def _record_stats(self, result, first_token_ms=None, caller=None):
+        """Keep the timings Ollama reports with a finished response, in milliseconds
+        
+        ``prompt_eval_ms`` is what a reused prefix saves: the server only
+        evaluates prompt tokens that are not already in its KV cache.
+        """
+        self.last_stats = {
+            "model": result.get("model", self.model),
+            "prompt_eval_count": result.get("prompt_eval_count", 0),
+            "prompt_eval_ms": result.get("prompt_eval_duration", 0) / 1e6,
+            "eval_count": result.get("eval_count", 0),
+            "eval_ms": result.get("eval_duration", 0) / 1e6,
+            "load_ms": result.get("load_duration", 0) / 1e6,
+            "total_ms": result.get("total_duration", 0) / 1e6,
+            "first_token_ms": first_token_ms
+        }
+        self.metrics.record(caller or self.caller, self.model, self.last_stats)
+        return self.last_stats
+    
+    def _count(self, caller, name):
+        self.metrics.count(caller or self.caller, self.model, name)
+    
+    def _stream_chunks(self, path, payload, caller=None, tried=None):
+        """Yield the decoded NDJSON chunks of a streaming call, up to the final "done" one
+        
+        Raises RuntimeError for an error status or an error chunk.
+        """
+        started = time.monotonic()
+        first_token_ms = None
+        done = False
+        self.last_stats = None
+        response = None
+        try:
+            with self._request("POST", path, tried, json=payload, stream=True) as response:
+                if response.status_code != 200:
+                    print(f"Error from Ollama API: {response.status_code} - {response.text}")
+                    raise RuntimeError(f"Unable to get response from Ollama (Status {response.status_code})")
+                
+                # One JSON object per line; the last one has "done": true
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"])
+                    if first_token_ms is None:
+                        first_token_ms = (time.monotonic() - started) * 1000
+                        # A stream that is abandoned early still reports its time to first token
+                        self.last_stats = {"model": self.model, "first_token_ms": first_token_ms}
+                    if chunk.get("done"):
+                        done = True
+                        self._record_stats(chunk, first_token_ms, caller)
+                    yield chunk
+                    if done:
+                        return
+        finally:
+            if response is not None:
+                self._release(response)
+            if not done and first_token_ms is not None:
+                self.metrics.record(caller or self.caller, self.model, self.last_stats)
+    
+    def generate_response(self, prompt, system_prompt=None, speak_response=False, options=None, use_cache=None,
+                          caller=None, deadline=None, hedge_after=None):
+        self.last_fallback = False
+        try:
+            cache_key = self._cache_key(prompt, system_prompt, options, use_cache)
+            if cache_key is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self._count(caller, "cache_hits")
+                    if speak_response:
+                        self.tts.speak(cached)
+                    return cached
             
             payload = {
                 "model": self.model,
                 "prompt": prompt,
-                "stream": False
+                "stream": False,
+                "keep_alive": self.keep_alive
             }
             
             if system_prompt:
                 payload["system"] = system_prompt
+            if options:
+                payload["options"] = options
             
-            response = requests.post(url, json=payload)
+            try:
+                status, result, shared = self._post("/generate", payload, caller, deadline, hedge_after)
+            except DeadlineExceeded:
+                status, result, shared = 200, {"response": self._fallback(prompt, caller)}, True
             
-            if response.status_code == 200:
-                result = response.json()
+            if status == 200:
                 response_text = result.get("response", "")
+                if not shared:
+                    self._record_stats(result, caller=caller)
+                    self.fallback.remember(prompt, response_text)
+                    if cache_key is not None:
+                        self.cache.put(cache_key, response_text, self.model)
                 
                 # Speak the response if requested
                 if speak_response:
@@ -34,8 +523,9 @@ class OllamaInterface:
                     
                 return response_text
             else:
-                error_msg = f"Error: Unable to get response from Ollama (Status {response.status_code})"
-                print(f"Error from Ollama API: {response.status_code} - {response.text}")
+                error_msg = f"Error: Unable to get response from Ollama (Status {status})"
+                print(f"Error from Ollama API: {status} - {result}")
+                self._count(caller, "errors")
                 
                 if speak_response:
                     self.tts.speak(error_msg)
@@ -44,16 +534,131 @@ class OllamaInterface:
         except Exception as e:
             error_msg = f"Error: {str(e)}"
             print(f"Error communicating with Ollama: {str(e)}")
+            self._count(caller, "errors")
             
             if speak_response:
                 self.tts.speak(error_msg)
                 
             return error_msg
     
+    def generate_stream(self, prompt, system_prompt=None, options=None, use_cache=None, caller=None, deadline=None,
+                        hedge_after=None):
+        """Yield the response text piece by piece as Ollama generates it
+        
+        Closing the generator early (e.g. once enough has been said) closes
+        the connection, which makes Ollama stop generating (once every
+        caller sharing the stream has stopped). Only responses that were
+        streamed to the end are stored in the response cache.
+        """
+        self.last_fallback = False
+        cache_key = self._cache_key(prompt, system_prompt, options, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._count(caller, "cache_hits")
+                yield cached
+                return
+        
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.keep_alive
+        }
+        
+        if system_prompt:
+            payload["system"] = system_prompt
+        if options:
+            payload["options"] = options
+        
+        pieces = []
+        chunks = None
+        try:
+            chunks, shared = self._shared_chunks("/generate", payload, caller, deadline, hedge_after)
+            for chunk in chunks:
+                if chunk.get("response"):
+                    pieces.append(chunk["response"])
+                    yield chunk["response"]
+                if chunk.get("done") and not shared:
+                    self.fallback.remember(prompt, "".join(pieces))
+                    if cache_key is not None:
+                        self.cache.put(cache_key, "".join(pieces), self.model)
+        except DeadlineExceeded:
+            yield self._fallback(prompt, caller)
+        except Exception as e:
+            print(f"Error communicating with Ollama: {str(e)}")
+            self._count(caller, "errors")
+            yield f"Error: {str(e)}"
+        finally:
+            if chunks is not None:
+                chunks.close()
+    
+    def chat(self, messages, options=None, caller=None, deadline=None, hedge_after=None):
+        """Answer a list of {"role", "content"} messages through /api/chat"""
+        self.last_fallback = False
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": self.keep_alive
+        }
+        if options:
+            payload["options"] = options
+        
+        try:
+            status, result, shared = self._post("/chat", payload, caller, deadline, hedge_after)
+            if status == 200:
+                content = result.get("message", {}).get("content", "")
+                if not shared:
+                    self._record_stats(result, caller=caller)
+                    self.fallback.remember(self._question(messages), content)
+                return content
+            print(f"Error from Ollama API: {status} - {result}")
+            self._count(caller, "errors")
+            return f"Error: Unable to get response from Ollama (Status {status})"
+        except DeadlineExceeded:
+            return self._fallback(self._question(messages), caller)
+        except Exception as e:
+            print(f"Error communicating with Ollama: {str(e)}")
+            self._count(caller, "errors")
+            return f"Error: {str(e)}"
+    
+    def chat_stream(self, messages, options=None, caller=None, deadline=None, hedge_after=None):
+        """Like chat(), but yields the answer piece by piece (see generate_stream)"""
+        self.last_fallback = False
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "keep_alive": self.keep_alive
+        }
+        if options:
+            payload["options"] = options
+        
+        pieces = []
+        chunks = None
+        try:
+            chunks, shared = self._shared_chunks("/chat", payload, caller, deadline, hedge_after)
+            for chunk in chunks:
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    pieces.append(content)
+                    yield content
+                if chunk.get("done") and not shared:
+                    self.fallback.remember(self._question(messages), "".join(pieces))
+        except DeadlineExceeded:
+            yield self._fallback(self._question(messages), caller)
+        except Exception as e:
+            print(f"Error communicating with Ollama: {str(e)}")
+            self._count(caller, "errors")
+            yield f"Error: {str(e)}"
+        finally:
+            if chunks is not None:
+                chunks.close()
+    
     def list_models(self):
         try:
-            url = f"{self.api_url}/tags"
-            response = requests.get(url)
+            response = self._request("GET", "/tags")
             
             if response.status_code == 200:
                 result = response.json()
@@ -65,13 +670,295 @@ class OllamaInterface:
             print(f"Error listing models: {str(e)}")
             return []
 
+class ChatSession:
+    """A running /api/chat conversation with a fixed system prompt
+    
+    Messages are sent exactly as they were the turn before, so the system
+    prompt and earlier turns form a stable prefix the server can serve from
+    its KV cache instead of re-evaluating it every turn. When the history
+    outgrows ``max_messages`` the older half is dropped in one go, which
+    breaks the cached prefix once rather than on every turn. With a
+    PromptBuilder (see prompt_builder.py) the history is also kept within
+    the model's context window, its system prompt is used and its
+    ``num_ctx`` is sent with every call, so the server's window is the one
+    the history was fitted to.
+    """
+    
+    def __init__(self, ollama, system_prompt="", max_messages=24, caller="conversation", builder=None):
+        self.ollama = ollama
+        self.builder = builder
+        if builder is not None and not system_prompt:
+            system_prompt = builder.system_prompt
+        self.system_prompt = system_prompt
+        self.max_messages = max_messages
+        self.caller = caller
+        self.messages = []
+    
+    def prepare(self, content, system_prompt=None):
+        """Record a user message and return the full message list to send for it"""
+        if system_prompt is not None and system_prompt != self.system_prompt:
+            # A new system prompt invalidates the cached prefix anyway; start over
+            self.system_prompt = system_prompt
+            self.messages = []
+        if len(self.messages) >= self.max_messages:
+            self.messages = self.messages[len(self.messages) // 2:]
+            # Keep the history starting on a user turn
+            while self.messages and self.messages[0]["role"] != "user":
+                self.messages.pop(0)
+        self.messages.append({"role": "user", "content": content})
+        if self.builder is not None:
+            self.messages = self.builder.fit(self.messages)
+        
+        system = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        return system + self.messages
+    
+    def options(self, options=None):
+        """Model options for this session's calls: ``options`` plus the builder's context size"""
+        if self.builder is None:
+            return options
+        return dict(options or {}, num_ctx=self.builder.num_ctx)
+    
+    def stream(self, content, system_prompt=None, options=None):
+        """Send a user message and yield the reply; record what was kept with add_reply()"""
+        return self.ollama.chat_stream(self.prepare(content, system_prompt), self.options(options), self.caller)
+    
+    def ask(self, content, system_prompt=None, options=None):
+        """Send a user message and return (and record) the whole reply"""
+        reply = self.ollama.chat(self.prepare(content, system_prompt), self.options(options), self.caller)
+        self.add_reply(reply)
+        return reply
+    
+    def add_reply(self, content, fallback=None):
+        """Record the reply to the last user message
+        
+        Errors and fallback answers (``fallback`` defaults to whether this
+        session's interface answered the last call from its fallback) are
+        not real replies and are not kept.
+        """
+        if fallback is None:
+            fallback = self.ollama.last_fallback
+        if fallback or content.startswith("Error:"):
+            # The turn failed: forget the unanswered message so the history stays well-formed
+            if self.messages and self.messages[-1]["role"] == "user":
+                self.messages.pop()
+            return
+        self.messages.append({"role": "assistant", "content": content})
+    
+    def reset(self):
+        self.messages = []
+
+class OllamaServer:
+    """Long-running front end that answers newline-delimited JSON requests
+    
+    Each request line is an object with an ``id`` and an ``op`` ("generate"
+    by default, "chat", "list_models" or "cancel") plus the usual fields
+    (prompt, system, model, options, cache, speak, stream, messages,
+    deadline). Every
+    reply line carries the request's ``id``: streamed requests send
+    {"id", "chunk"} lines, and every request ends with one
+    {"id", "response", "done": true} or {"id", "error"} line. Requests run
+    concurrently on a thread pool, so replies may arrive out of order.
+    
+    One OllamaInterface per model (and so one connection pool), a single
+    response cache and a single SingleFlight are shared by all requests, so
+    identical requests from different clients that overlap reach the model
+    once.
+    """
+    
+    def __init__(self, model="mistral", max_workers=4, **interface_options):
+        self.default_model = model
+        # Several hosts: one pool for every model, so load and affinity are tracked across them
+        if isinstance(interface_options.get("api_url"), (list, tuple)):
+            interface_options["api_url"] = EndpointPool(interface_options["api_url"])
+        self.interface_options = interface_options
+        self.cache = ResponseCache()
+        self.flights = SingleFlight()
+        self._interfaces = {}
+        self._lock = threading.Lock()
+        # Everything is spoken on one thread that has COM initialized, where the voice is also created
+        self._speaker = concurrent.futures.ThreadPoolExecutor(1, initializer=_init_com)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        # Ids of requests queued or running; only those can be cancelled
+        self._running = set()
+        self._cancelled = set()
+        self._requests_lock = threading.Lock()
+    
+    def interface(self, model=None):
+        model = model or self.default_model
+        with self._lock:
+            if model not in self._interfaces:
+                self._interfaces[model] = OllamaInterface(model=model, cache=self.cache, single_flight=self.flights,
+                                                         **self.interface_options)
+            return self._interfaces[model]
+    
+    def handle_line(self, line, send):
+        """Parse one request line and start it; returns its Future (None if nothing was started)"""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            send({"id": None, "error": "Request is not valid JSON"})
+            return None
+        
+        request_id = request.get("id")
+        with self._requests_lock:
+            if request.get("op") == "cancel":
+                # Streamed requests stop at their next chunk; one-shot calls cannot be interrupted.
+                # Cancels for finished or unknown ids are ignored, so a reused id is not hit later
+                if request_id in self._running:
+                    self._cancelled.add(request_id)
+                return None
+            self._running.add(request_id)
+        return self._executor.submit(self._handle, request, send)
+    
+    def _stream(self, request_id, pieces, send):
+        kept = []
+        try:
+            for piece in pieces:
+                if request_id in self._cancelled:
+                    break
+                kept.append(piece)
+                send({"id": request_id, "chunk": piece})
+        finally:
+            pieces.close()
+        return "".join(kept)
+    
+    def _handle(self, request, send):
+        request_id = request.get("id")
+        try:
+            op = request.get("op", "generate")
+            ollama = self.interface(request.get("model"))
+            if op == "list_models":
+                send({"id": request_id, "models": ollama.list_models(), "done": True})
+                return
+            
+            deadline = request.get("deadline")
+            if op == "chat":
+                if request.get("stream"):
+                    response = self._stream(request_id, ollama.chat_stream(request["messages"], request.get("options"),
+                                                                           deadline=deadline), send)
+                else:
+                    response = ollama.chat(request["messages"], request.get("options"), deadline=deadline)
+            elif op == "generate":
+                arguments = (request.get("prompt", ""), request.get("system"))
+                if request.get("stream"):
+                    response = self._stream(request_id, ollama.generate_stream(*arguments, request.get("options"),
+                                                                               request.get("cache"), deadline=deadline),
+                                            send)
+                else:
+                    response = ollama.generate_response(*arguments, False, request.get("options"), request.get("cache"),
+                                                        deadline=deadline)
+            else:
+                send({"id": request_id, "error": f"Unknown op: {op}"})
+                return
+            
+            if request.get("speak"):
+                self._speaker.submit(lambda: ollama.tts.speak(response)).result()
+            send({"id": request_id, "response": response, "cancelled": request_id in self._cancelled,
+                  "done": True})
+        except Exception as e:
+            print(f"Error handling request {request_id}: {str(e)}", file=sys.stderr)
+            send({"id": request_id, "error": str(e)})
+        finally:
+            with self._requests_lock:
+                self._running.discard(request_id)
+                self._cancelled.discard(request_id)
+    
+    def serve_stdio(self, warmup=True):
+        """Answer requests from stdin on stdout until stdin closes"""
+        out_lock = threading.Lock()
+        # stdout carries the protocol; route diagnostic prints to stderr
+        protocol_out = sys.stdout
+        sys.stdout = sys.stderr
+        
+        def send(message):
+            with out_lock:
+                protocol_out.write(json.dumps(message) + "\n")
+                protocol_out.flush()
+        
+        if warmup:
+            self.interface().warmup()
+        send({"ready": True})
+        for line in sys.stdin:
+            if line.strip():
+                self.handle_line(line, send)
+        self.close()
+    
+    def serve_socket(self, host="127.0.0.1", port=11500, warmup=True):
+        """Answer requests on a local TCP socket; each connection is its own request stream"""
+        server = self
+        if warmup:
+            self.interface().warmup()
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                out_lock = threading.Lock()
+                
+                def send(message):
+                    with out_lock:
+                        try:
+                            self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+                            self.wfile.flush()
+                        except OSError:
+                            pass
+                
+                pending = []
+                for line in self.rfile:
+                    if line.strip():
+                        future = server.handle_line(line.decode("utf-8"), send)
+                        if future is not None:
+                            pending.append(future)
+                # Finish this connection's requests before its socket is closed
+                concurrent.futures.wait(pending)
+        
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        with socketserver.ThreadingTCPServer((host, port), Handler) as tcp_server:
+            tcp_server.daemon_threads = True
+            print(f"Ollama request server listening on {host}:{port}", file=sys.stderr)
+            try:
+                tcp_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        self.close()
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._speaker.shutdown(wait=True)
+        for ollama in self._interfaces.values():
+            ollama.session.close()
+        if isinstance(self.interface_options.get("api_url"), EndpointPool):
+            self.interface_options["api_url"].close()
+        self.cache.close()
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        # Long-running mode: one process answers many requests (see OllamaServer)
+        import argparse
+        
+        parser = argparse.ArgumentParser(description="Ollama request server")
+        parser.add_argument("--serve", action="store_true")
+        parser.add_argument("--model", default="mistral")
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--port", type=int, help="Listen on this local TCP port instead of stdin/stdout")
+        parser.add_argument("--api-url", default="http://localhost:11434/api",
+                            help="Ollama API URL, or several comma-separated ones to load balance over")
+        args = parser.parse_args()
+        
+        api_url = args.api_url.split(",") if "," in args.api_url else args.api_url
+        server = OllamaServer(model=args.model, max_workers=args.workers, api_url=api_url)
+        if args.port:
+            server.serve_socket(port=args.port)
+        else:
+            server.serve_stdio()
+        sys.exit(0)
+    
     # This will be used when called directly from Node.js
     if len(sys.argv) > 1:
         prompt = sys.argv[1]
         model = "mistral"  # Default model when called from command line
         system_prompt = None
         speak_response = True  # Enable speaking by default when called from command line
+        options = None
+        use_cache = None
     else:
         # Read from stdin if no arguments
         data = sys.stdin.read()
@@ -81,12 +968,17 @@ if __name__ == "__main__":
             model = input_data.get("model", "mistral")
             system_prompt = input_data.get("system", None)
             speak_response = input_data.get("speak", False)
+            options = input_data.get("options")
+            use_cache = input_data.get("cache")
         except:
             prompt = data
             model = "mistral"
             system_prompt = None
             speak_response = True
+            options = None
+            use_cache = None
     
     ollama = OllamaInterface(model=model)
-    response = ollama.generate_response(prompt, system_prompt, speak_response)
+    response = ollama.generate_response(prompt, system_prompt, speak_response, options, use_cache)
+    ollama.close()
     print(json.dumps({"response": response}))
\ No newline at end of file
@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class OllamaStub:
+    """Tiny local stand-in for the Ollama HTTP API, for benchmarks and offline checks
+    
+    Answers /api/generate and /api/chat (streamed or not) with a fixed
+    ``reply`` and /api/tags with ``models``; calls for any other model get a
+    404 like they would from a server that has not pulled it. ``latency`` is
+    added before every answer and ``token_delay`` between streamed words.
+    Connections are kept alive like the real server's, so connection reuse
+    can be measured. ``requests`` counts every request, ``generations``
+    only the ones that produced a reply.
+    
+    Like the real server, only the part of a prompt that differs from the
+    previous prompt is "evaluated" (about 4 characters per token, each taking
+    ``prompt_token_delay``) and reported as prompt_eval_count/duration.
+    """
+    
+    def __init__(self, host="127.0.0.1", port=0, reply="Hello from the stub server.", models=("mistral",),
+                 latency=0.0, token_delay=0.0, prompt_token_delay=0.0):
+        self.reply = reply
+        self.models = list(models)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.requests = 0
+        self.generations = 0
+        self.connections = 0
+        self.last_prompt = ""
+        self.last_request = None
+        self._sockets = set()
+        
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def log_message(self, format, *args):
+                pass
+            
+            def setup(self):
+                super().setup()
+                # Headers and body go out as separate writes; without this, delayed ACKs
+                # add ~40 ms to every request on a kept-alive connection
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                stub.connections += 1
+                stub._sockets.add(self.connection)
+            
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    # The client dropped a kept-alive connection (e.g. it abandoned a hedged request)
+                    pass
+            
+            def finish(self):
+                stub._sockets.discard(self.connection)
+                super().finish()
+            
+            def _send_json(self, data, status=200):
+                body = json.dumps(data).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on this request (e.g. it was cancelled)
+                    self.close_connection = True
+            
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": name, "model": name} for name in stub.models]})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+            
+            def do_POST(self):
+                stub.requests += 1
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                stub.last_request = request
+                time.sleep(stub.latency)
+                if self.path not in ("/api/generate", "/api/chat"):
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                model = request.get("model")
+                if model not in stub.models and f"{model}:latest" not in stub.models:
+                    self._send_json({"error": f"model \"{model}\" not found, try pulling it first"}, 404)
+                    return
+                
+                if "prompt" not in request and "messages" not in request:
+                    # A load-only request (warmup): the real server answers right away
+                    self._send_json({"model": request.get("model"), "response": "", "done": True})
+                    return
+                
+                stub.generations += 1
+                stats = stub._evaluate_prompt(request)
+                if request.get("stream", True):
+                    self._stream(request, stats)
+                else:
+                    self._send_json(dict(self._piece(request, stub.reply), done=True, **stats))
+            
+            def _piece(self, request, text):
+                if self.path == "/api/chat":
+                    return {"model": request.get("model"), "message": {"role": "assistant", "content": text}}
+                return {"model": request.get("model"), "response": text}
+            
+            def _stream(self, request, stats):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = stub.reply.split(" ")
+                try:
+                    for i, word in enumerate(words):
+                        piece = word if i == len(words) - 1 else word + " "
+                        self._chunk(dict(self._piece(request, piece), done=False))
+                        time.sleep(stub.token_delay)
+                    self._chunk(dict(self._piece(request, ""), done=True, **stats))
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading (e.g. it had heard enough)
+                    self.close_connection = True
+            
+            def _chunk(self, data):
+                line = (json.dumps(data) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+    
+    def _evaluate_prompt(self, request):
+        if "messages" in request:
+            prompt = json.dumps(request["messages"])
+        else:
+            prompt = json.dumps([request.get("system", ""), request.get("prompt", "")])
+        shared = len(os.path.commonprefix([prompt, self.last_prompt]))
+        self.last_prompt = prompt
+        
+        tokens = (len(prompt) - shared) // 4 + 1
+        time.sleep(tokens * self.prompt_token_delay)
+        words = len(self.reply.split(" "))
+        return {
+            "prompt_eval_count": tokens,
+            "prompt_eval_duration": int(tokens * self.prompt_token_delay * 1e9),
+            "eval_count": words,
+            "eval_duration": int(words * self.token_delay * 1e9),
+            "total_duration": int((self.latency + tokens * self.prompt_token_delay + words * self.token_delay) * 1e9)
+        }
+    
+    @property
+    def api_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api"
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop serving, dropping kept-alive connections too (like a host going down)"""
+        self.server.shutdown()
+        self.server.server_close()
+        for sock in list(self._sockets):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def run_benchmark(calls=200):
+    """Per-request overhead of a new connection per call versus OllamaInterface's pooled session"""
+    import requests
+    from ollama_interface import OllamaInterface
+    
+    with OllamaStub() as stub:
+        results = {}
+        
+        stub.connections = 0
+        start = time.perf_counter()
+        for _ in range(calls):
+            requests.post(f"{stub.api_url}/generate", json={"model": "mistral", "prompt": "hi", "stream": False})
+        results["requests.post per call"] = (time.perf_counter() - start, stub.connections)
+        
+        ollama = OllamaInterface(api_url=stub.api_url)
+        stub.connections = 0
+        start = time.perf_counter()
+        for _ in range(calls):
+            ollama.generate_response("hi")
+        results["pooled session"] = (time.perf_counter() - start, stub.connections)
+        ollama.close()
+    
+    for name, (elapsed, connections) in results.items():
+        print(f"{name:>24}: {elapsed / calls * 1000:.3f} ms/request, {connections} connections for {calls} requests")
+    return results
+
+def run_single_flight(callers=8, latency=0.5):
+    """Send ``callers`` identical calls at once, blocking and streamed, and count the upstream requests
+    
+    With single-flight coalescing each batch should reach the stub server
+    exactly once. Returns whether every mode made exactly one upstream
+    request and gave every caller the stub's reply.
+    """
+    from ollama_interface import OllamaInterface
+    
+    def run_all(call):
+        barrier = threading.Barrier(callers)
+        replies = []
+        
+        def run():
+            barrier.wait()
+            replies.append(call())
+        
+        threads = [threading.Thread(target=run) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return replies
+    
+    with OllamaStub(latency=latency, token_delay=0.01) as stub:
+        ollama = OllamaInterface(api_url=stub.api_url, cache=False, pool_size=callers)
+        ok = True
+        for mode, call in (("generate", lambda: ollama.generate_response("hi")),
+                           ("stream", lambda: "".join(ollama.generate_stream("hi")))):
+            stub.requests = 0
+            start = time.perf_counter()
+            replies = run_all(call)
+            elapsed = time.perf_counter() - start
+            same = len(replies) == callers and all(reply == stub.reply for reply in replies)
+            print(f"{mode:>9}: {callers} callers -> {stub.requests} upstream request(s) in {elapsed:.2f}s, "
+                  f"{'all replies identical' if same else 'replies differ'}")
+            ok = ok and same and stub.requests == 1
+        ollama.close()
+    return ok
+
+def run_pool(calls=40, workers=8):
+    """Load balance over three stubs (fast, slow, and one without the model), then fail one and bring it back
+
+    Prints how the calls were spread and the pool's view of each endpoint.
+    Returns whether no call failed, the stopped stub was ejected and the
+    restarted one was admitted again.
+    """
+    from ollama_interface import OllamaInterface
+    from endpoint_pool import EndpointPool
+    import concurrent.futures
+    
+    fast = OllamaStub(latency=0.02).start()
+    slow = OllamaStub(latency=0.3).start()
+    other = OllamaStub(latency=0.02, models=("phi3",)).start()
+    stubs = {"fast": fast, "slow": slow, "other": other}
+    pool = EndpointPool([stub.api_url for stub in stubs.values()], probe_interval=0.5)
+    ollama = OllamaInterface(api_url=pool, cache=False, single_flight=False, max_retries=3)
+    small = OllamaInterface(model="phi3", api_url=pool, cache=False, single_flight=False)
+    pool.probe_all()
+    
+    errors = 0
+    
+    def burst(label):
+        nonlocal errors
+        for stub in stubs.values():
+            stub.generations = 0
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            replies = list(executor.map(lambda i: ollama.generate_response(f"prompt {i}"), range(calls)))
+            replies += list(executor.map(lambda i: small.generate_response(f"prompt {i}"), range(calls // 4)))
+        failed = sum(reply.startswith("Error:") for reply in replies)
+        errors += failed
+        spread = ", ".join(f"{name} {stub.generations}" for name, stub in stubs.items())
+        print(f"{label:>12}: {len(replies)} calls ({failed} errors) -> {spread}")
+    
+    def health():
+        return ", ".join(f"{name} {'up' if endpoint['healthy'] else 'ejected'}"
+                         for name, endpoint in zip(stubs, pool.stats()))
+    
+    burst("all up")
+    port = fast.server.server_address[1]
+    fast.stop()
+    burst("fast down")
+    print(f"{'':>12}  {health()}")
+    ejected = not pool.stats()[0]["healthy"]
+    stubs["fast"] = fast = OllamaStub(port=port, latency=0.02).start()
+    time.sleep(pool.probe_interval * 2)
+    print(f"{'':>12}  after restart: {health()}")
+    readmitted = pool.stats()[0]["healthy"]
+    burst("fast back")
+    
+    ollama.close()
+    small.close()
+    pool.close()
+    for stub in stubs.values():
+        stub.stop()
+    return errors == 0 and ejected and readmitted
+
+def run_deadlines(calls=20, deadline=1.0):
+    """Bound calls to a stub that sometimes stalls: hedge to a faster "small model" stub, then fall back
+    
+    Prints the worst latency seen and the hedge/deadline counters.
+    """
+    from ollama_interface import OllamaInterface
+    from llm_metrics import MetricsRegistry
+    
+    metrics = MetricsRegistry()
+    with OllamaStub(reply="large model answer") as large, \
+            OllamaStub(reply="small model answer", models=("phi3",), latency=0.05) as small:
+        hedge = OllamaInterface(model="phi3", api_url=small.api_url, cache=False, metrics=metrics)
+        ollama = OllamaInterface(api_url=large.api_url, cache=False, metrics=metrics, hedge_after=deadline / 4,
+                                 hedge=hedge, deadline=deadline)
+        worst = 0.0
+        for i in range(calls):
+            # Every fourth call stalls; from halfway on, the small model stalls too
+            large.latency = 3 * deadline if i % 4 == 3 else 0.01
+            small.latency = 3 * deadline if i >= calls // 2 else 0.05
+            start = time.perf_counter()
+            ollama.generate_response(f"question {i % 3}")
+            worst = max(worst, time.perf_counter() - start)
+        counters = metrics.query(model=ollama.model)[0]["counters"]
+        print(f"{calls} calls, deadline {deadline:g}s: worst latency {worst:.2f}s, "
+              f"{counters.get('hedges', 0)} hedges, {counters.get('hedge_wins', 0)} hedge wins, "
+              f"{counters.get('deadline_hits', 0)} deadline hits")
+        ollama.close()
+        hedge.close()
+    return counters
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Ollama stub server / HTTP overhead micro-benchmark")
+    parser.add_argument("--serve", action="store_true", help="Only run the stub server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--pool", action="store_true",
+                        help="Show load balancing, ejection and re-admission over several stubs")
+    parser.add_argument("--deadlines", action="store_true",
+                        help="Show hedged requests and deadline fallbacks against a stalling stub")
+    parser.add_argument("--single-flight", type=int, metavar="CALLERS",
+                        help="Check that this many identical concurrent calls make one upstream request")
+    args = parser.parse_args()
+    
+    if args.serve:
+        stub = OllamaStub(port=args.port)
+        print(f"Stub Ollama API listening on {stub.api_url}")
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            stub.stop()
+    elif args.deadlines:
+        run_deadlines()
+    elif args.pool:
+        sys.exit(0 if run_pool() else 1)
+    elif args.single_flight:
+        sys.exit(0 if run_single_flight(args.single_flight) else 1)
+    else:
+        run_benchmark(args.calls)
@@ -0,0 +1,131 @@
+import re
+import math
+import threading
+
+from lru_cache import LRUCache
+
+# Words, numbers and single punctuation marks, roughly how BPE tokenizers split text
+PIECE = re.compile(r"\w+|[^\w\s]")
+
+# Chat templates wrap every message in a few role/separator tokens
+MESSAGE_OVERHEAD = 4
+
+class TokenEstimator:
+    """Fast approximate token counts, without loading the model's tokenizer
+    
+    Short words count as one token and longer ones as one per
+    ``chars_per_token`` characters; non-ASCII text counts a token per
+    character. Counts are memoized, so the unchanged system prompt and
+    history cost a lookup per turn. Use for_model() to share one per model.
+    """
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    def __init__(self, chars_per_token=4.0, cache_size=1024):
+        self.chars_per_token = chars_per_token
+        self._counts = LRUCache(cache_size)
+    
+    @classmethod
+    def for_model(cls, model):
+        with cls._instances_lock:
+            estimator = cls._instances.get(model)
+            if estimator is None:
+                estimator = cls._instances[model] = cls()
+            return estimator
+    
+    def count(self, text):
+        if not text:
+            return 0
+        tokens = self._counts.get(text)
+        if tokens is None:
+            tokens = 0
+            for piece in PIECE.findall(text):
+                if piece.isascii():
+                    tokens += max(1, math.ceil(len(piece) / self.chars_per_token))
+                else:
+                    tokens += len(piece)
+            self._counts.put(text, tokens)
+        return tokens
+    
+    def count_messages(self, messages):
+        return sum(self.count(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+
+class PromptBuilder:
+    """Lay out each conversation turn within the model's context window
+    
+    The system prompt is fixed when the builder is made and sent unchanged
+    every turn, so the server can keep it in its KV cache. Of the
+    ``num_ctx`` tokens, ``reply_tokens`` are left for the answer and the
+    rest is filled by priority: the system prompt, the user's input, then
+    retrieved memories (at most ``memory_share`` of what is left), then as
+    much recent history as fits. Too long a history is cut back to
+    ``low_water`` of its budget in one go, so the cached prefix breaks once
+    rather than every turn.
+    
+    ``last_sizes`` holds the token counts of the latest turn.
+    """
+    
+    def __init__(self, system_prompt, model=None, num_ctx=4096, reply_tokens=256, memory_share=0.25, low_water=0.6):
+        self.system_prompt = system_prompt
+        self.num_ctx = num_ctx
+        self.reply_tokens = reply_tokens
+        self.memory_share = memory_share
+        self.low_water = low_water
+        self.estimator = TokenEstimator.for_model(model)
+        self.system_tokens = self.estimator.count_messages([{"content": system_prompt}]) if system_prompt else 0
+        self.last_sizes = None
+        self._turn = None
+    
+    def available(self):
+        """Tokens left for input, memories and history"""
+        return max(0, self.num_ctx - self.reply_tokens - self.system_tokens)
+    
+    def memory_budget(self, user_input):
+        """How many tokens of memories this input leaves room for"""
+        left = self.available() - self.estimator.count(user_input) - MESSAGE_OVERHEAD
+        return max(0, int(min(left, self.available() * self.memory_share)))
+    
+    def compose(self, user_input, memory_context=""):
+        """The user message for this turn: the input, after any memories"""
+        self._turn = {
+            "input": self.estimator.count(user_input),
+            "memories": self.estimator.count(memory_context)
+        }
+        if memory_context:
+            return f"{memory_context}\nPlease respond to: {user_input}"
+        return user_input
+    
+    def fit(self, messages):
+        """Drop the oldest turns of ``messages`` (ending with this turn's user message) to fit the window
+        
+        Returns the messages to send after the system prompt; the result
+        still starts on a user turn.
+        """
+        current = self.estimator.count_messages(messages[-1:])
+        history = messages[:-1]
+        history_tokens = self.estimator.count_messages(history)
+        budget = max(0, self.available() - current)
+        dropped = 0
+        if history_tokens > budget:
+            target = budget * self.low_water
+            while history and (history_tokens > target or history[0]["role"] != "user"):
+                history_tokens -= self.estimator.count_messages(history[:1])
+                history = history[1:]
+                dropped += 1
+        
+        turn = self._turn or {"input": current, "memories": 0}
+        self._turn = None
+        self.last_sizes = dict(turn, system=self.system_tokens, history=history_tokens, dropped=dropped,
+                               total=self.system_tokens + history_tokens + current, num_ctx=self.num_ctx)
+        return history + messages[-1:]
+    
+    def report(self):
+        sizes = self.last_sizes
+        if sizes is None:
+            return ""
+        text = (f"Prompt ~{sizes['total']} of {sizes['num_ctx']} tokens: system {sizes['system']}, "
+                f"memories {sizes['memories']}, history {sizes['history']}, input {sizes['input']}")
+        if sizes["dropped"]:
+            text += f" ({sizes['dropped']} old messages dropped)"
+        return text
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from lru_cache import LRUCache
+
+class ResponseCache:
+    """Two-tier cache of model responses: an in-memory LRU in front of a SQLite table
+    
+    Entries expire ``ttl`` seconds after they were stored, and the table is
+    trimmed to ``max_entries`` rows (least recently used first). The
+    database is only opened on first use.
+    """
+    
+    def __init__(self, db_path=None, memory_size=256, ttl=7 * 24 * 3600, max_entries=5000):
+        if db_path is None:
+            db_path = os.path.join(os.path.expanduser("~"), "HumanAI", "response_cache.db")
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = LRUCache(memory_size)
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._puts = 0
+    
+    @staticmethod
+    def make_key(model, system_prompt, prompt, options=None):
+        """Stable hash of everything that determines the response"""
+        material = json.dumps([model, system_prompt or "", prompt, options or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+    
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT,
+                    created REAL,
+                    last_used REAL
+                )
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._conn.commit()
+        return self._conn
+    
+    def get(self, key):
+        """Cached response for ``key``, or None"""
+        entry = self.memory.get(key)
+        now = time.time()
+        if entry is not None:
+            response, created = entry
+            if now - created <= self.ttl:
+                return response
+            self.memory.pop(key)
+        
+        try:
+            with self._lock:
+                conn = self._connect()
+                row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    self.disk_hits += 1
+                    self.memory.put(key, (row[0], row[1]))
+                    return row[0]
+        except sqlite3.Error as e:
+            print(f"Error reading response cache: {str(e)}")
+        self.misses += 1
+        return None
+    
+    def put(self, key, response, model=None):
+        now = time.time()
+        self.memory.put(key, (response, now))
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute("INSERT OR REPLACE INTO responses (key, model, response, created, last_used) "
+                             "VALUES (?, ?, ?, ?, ?)", (key, model, response, now, now))
+                self._puts += 1
+                if self._puts % 100 == 1:
+                    self._evict(conn, now)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing response cache: {str(e)}")
+    
+    def _evict(self, conn, now):
+        """Drop expired rows, then the least recently used ones beyond ``max_entries``"""
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC "
+                     "LIMIT -1 OFFSET ?)", (self.max_entries,))
+    
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+    
+    def stats(self):
+        """Hit counts per tier and the overall hit rate"""
+        memory = self.memory.stats()
+        # Every disk lookup starts as a memory miss
+        lookups = memory["hits"] + self.disk_hits + self.misses
+        return {
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (memory["hits"] + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_size": memory["size"]
+        }
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
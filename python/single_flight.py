@@ -0,0 +1,137 @@
+import threading
+import concurrent.futures
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one
+    
+    While a call for a key is in flight, other callers with the same key
+    wait for it and share its result (or exception) instead of starting
+    their own. Once it finishes the next call for the key starts afresh:
+    nothing is kept afterwards, that is what ResponseCache is for.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+    
+    def do(self, key, fn):
+        """Return (fn(), shared); shared is True for callers that joined a call already in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+        
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+    
+    def stream(self, key, open_stream):
+        """Return (iterator, shared) over the items of a stream opened by ``open_stream()``
+        
+        Only the first caller opens the stream; callers with the same key
+        that arrive while it runs read the same items, from the first one.
+        The upstream is closed once every reader has stopped reading.
+        """
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is not None and shared.join():
+                return shared.read(), True
+            shared = SharedStream(open_stream(), lambda: self._forget(key, shared))
+            shared.join()
+            self._streams[key] = shared
+        shared.start()
+        return shared.read(), False
+    
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls) + len(self._streams)
+    
+    def _forget(self, key, shared):
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+
+class SharedStream:
+    """One iterator fanned out to several readers, pulled on a daemon thread
+    
+    Items are buffered for the life of the stream so that late readers can
+    replay them. When the last reader stops, the stream stops too (at the
+    next item) and can no longer be joined.
+    """
+    
+    def __init__(self, source, on_finish):
+        self._source = source
+        self._on_finish = on_finish
+        self._items = []
+        self._readers = 0
+        self._closing = False
+        self._done = False
+        self._error = None
+        self._cond = threading.Condition()
+    
+    def join(self):
+        """Register a reader; False if the stream is already finishing"""
+        with self._cond:
+            if self._closing or self._done:
+                return False
+            self._readers += 1
+            return True
+    
+    def start(self):
+        thread = threading.Thread(target=self._pump)
+        thread.daemon = True
+        thread.start()
+    
+    def _pump(self):
+        try:
+            for item in self._source:
+                with self._cond:
+                    if self._closing:
+                        break
+                    self._items.append(item)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            if hasattr(self._source, "close"):
+                self._source.close()
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+            self._on_finish()
+    
+    def read(self):
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._items) and not self._done:
+                        self._cond.wait()
+                    if index < len(self._items):
+                        item = self._items[index]
+                        index += 1
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield item
+        finally:
+            with self._cond:
+                self._readers -= 1
+                abandoned = self._readers == 0 and not self._done
+                if abandoned:
+                    self._closing = True
+            if abandoned:
+                self._on_finish()
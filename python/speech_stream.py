@@ -0,0 +1,104 @@
+import re
+import queue
+import threading
+
+# End of a sentence: terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, or a blank line
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+|\n\s*\n")
+
+# Words whose trailing period does not end a sentence
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "e.g", "i.e", "approx", "no"}
+
+class SentenceSegmenter:
+    """Split text that arrives in pieces into complete sentences"""
+    
+    def __init__(self):
+        self._buffer = ""
+    
+    def feed(self, text):
+        """Add a piece of text and return the sentences it completed"""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            words = sentence.split()
+            if match.group().startswith(".") and words and words[-1].rstrip(".").lower() in ABBREVIATIONS:
+                continue
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+    
+    def flush(self):
+        """Return whatever is left once the text is complete (may be empty)"""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return rest
+
+def speak_streaming(chunks, speak, max_sentences=3, max_words=50, transform=None, stop_event=None):
+    """Speak a streamed reply sentence by sentence while the rest is still being generated
+    
+    ``chunks`` is an iterable of text pieces (e.g. OllamaInterface.generate_stream)
+    and ``speak`` is called with one sentence at a time from a worker thread.
+    Like the old "more than ``max_words`` words -> keep ``max_sentences``
+    sentences" truncation, generation stops once at least ``max_sentences``
+    sentences and more than ``max_words`` words have been produced. Closing
+    the stream early is what makes the model server stop generating.
+    
+    ``transform`` is applied to each sentence before it is spoken. Setting
+    ``stop_event`` (e.g. on a spoken "stop") abandons the rest of the reply;
+    the event is set when speaking has finished either way.
+    
+    Returns the text that was kept.
+    """
+    stop_event = stop_event or threading.Event()
+    pending = queue.Queue()
+    
+    def speaker():
+        while True:
+            sentence = pending.get()
+            if sentence is None:
+                break
+            if not stop_event.is_set():
+                speak(sentence)
+        stop_event.set()
+    
+    worker = threading.Thread(target=speaker)
+    worker.daemon = True
+    worker.start()
+    
+    segmenter = SentenceSegmenter()
+    kept = []
+    words = 0
+    
+    def keep(sentence):
+        nonlocal words
+        if transform is not None:
+            sentence = transform(sentence)
+        kept.append(sentence)
+        words += len(sentence.split())
+        pending.put(sentence)
+        return len(kept) >= max_sentences and words > max_words
+    
+    try:
+        finished = False
+        for chunk in chunks:
+            for sentence in segmenter.feed(chunk):
+                if keep(sentence):
+                    finished = True
+                    break
+            if finished or stop_event.is_set():
+                break
+        else:
+            rest = segmenter.flush()
+            if rest:
+                keep(rest)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        pending.put(None)
+    
+    worker.join()
+    return " ".join(kept)
@@ -0,0 +1,90 @@
+import zlib
+
+from prompt_builder import TokenEstimator
+from speech_stream import SentenceSegmenter
+
+def iter_paragraphs(source):
+    """Yield the blank-line separated paragraphs of a string or of an iterable of lines (e.g. an open file)"""
+    lines = source.splitlines() if isinstance(source, str) else source
+    paragraph = []
+    for line in lines:
+        if line.strip():
+            paragraph.append(line.rstrip("\r\n"))
+        elif paragraph:
+            yield "\n".join(paragraph)
+            paragraph = []
+    if paragraph:
+        yield "\n".join(paragraph)
+
+def split_sentences(text):
+    segmenter = SentenceSegmenter()
+    sentences = segmenter.feed(text)
+    rest = segmenter.flush()
+    return sentences + [rest] if rest else sentences
+
+def _units(paragraph, max_tokens, estimator):
+    """A paragraph as pieces of at most ``max_tokens``: itself, its sentences, or runs of words"""
+    if estimator.count(paragraph) <= max_tokens:
+        yield paragraph
+        return
+    for sentence in split_sentences(paragraph):
+        if estimator.count(sentence) <= max_tokens:
+            yield sentence
+            continue
+        words = []
+        for word in sentence.split():
+            if words and estimator.count(" ".join(words + [word])) > max_tokens:
+                yield " ".join(words)
+                words = []
+            words.append(word)
+        if words:
+            yield " ".join(words)
+
+def iter_chunks(source, max_tokens=1500, overlap_tokens=100, min_tokens=None, estimator=None):
+    """Yield chunks of about ``max_tokens`` or less, split on paragraph (or else sentence) boundaries
+    
+    ``source`` is a string or an iterable of lines, which is read as the
+    chunks are consumed. Each chunk after the first starts with the last
+    sentences (up to ``overlap_tokens``) of the one before.
+    
+    Once a chunk holds ``min_tokens`` (half of ``max_tokens`` by default)
+    it also ends after any paragraph whose hash is 0 mod 4. Boundaries
+    then depend on the text around them rather than on everything before,
+    so an edit only changes the chunks near it and the rest can be
+    answered from a cache.
+    """
+    estimator = estimator or TokenEstimator()
+    min_tokens = max_tokens // 2 if min_tokens is None else min_tokens
+    units = []
+    size = 0
+    overlap = []
+    
+    def close():
+        chunk = "\n\n".join(overlap + units)
+        # Carry the last few sentences over into the next chunk
+        tail = []
+        tail_size = 0
+        for sentence in reversed(split_sentences(units[-1])):
+            tail_size += estimator.count(sentence)
+            if tail_size > overlap_tokens:
+                break
+            tail.insert(0, sentence)
+        return chunk, [" ".join(tail)] if tail else []
+    
+    for paragraph in iter_paragraphs(source):
+        for unit in _units(paragraph, max_tokens - overlap_tokens, estimator):
+            unit_size = estimator.count(unit)
+            if units and size + unit_size > max_tokens:
+                chunk, overlap = close()
+                yield chunk
+                units = []
+                size = sum(estimator.count(text) for text in overlap)
+            units.append(unit)
+            size += unit_size
+            if size >= min_tokens and zlib.crc32(unit.encode("utf-8")) % 4 == 0:
+                chunk, overlap = close()
+                yield chunk
+                units = []
+                size = sum(estimator.count(text) for text in overlap)
+    if units:
+        yield close()[0]